@@ -0,0 +1,98 @@
+'''
+    scanlib command line
+
+    Starts a ScanLib server, e.g.:
+
+    scanlib ../../db/scanLib_settings.req -m P=2bmb: -m R=ScanLib:
+
+    then gives an interactive python prompt with the ScanLib object as ``ts``.
+    Use --time-startup to print how long each startup phase takes and exit.
+
+    Several ScanLib instances can be hosted in one process with a host file,
+    see host.py:
+
+    scanlib --config stations.json
+
+    the ScanLibHost is then available as ``host`` and its first instance as ``ts``.
+'''
+import sys
+import time
+import code
+import argparse
+
+from scanlib import log
+from scanlib import host
+
+
+def parse_macros(macros):
+    """Converts ['P=2bmb:', ...] to {'$(P)': '2bmb:', ...}"""
+
+    substitutions = {}
+    for macro in macros:
+        key, sep, value = macro.partition('=')
+        if sep == '':
+            raise argparse.ArgumentTypeError('macro %s must be NAME=VALUE' % macro)
+        substitutions[host.macro_key(key)] = value
+    return substitutions
+
+
+def main():
+    tic = time.time()
+    parser = argparse.ArgumentParser(description='Start a scanlib server')
+    parser.add_argument('pv_files', nargs='*', help='files listing the ScanLib PVs, e.g. scanLib_settings.req')
+    parser.add_argument('-m', '--macro', action='append', default=[],
+                        help='macro substitution NAME=VALUE, e.g. P=2bmb:, can be repeated')
+    parser.add_argument('-c', '--config', default=None,
+                        help='JSON file listing the pv_files and macros of several ScanLib instances')
+    parser.add_argument('--backend', choices=('ca', 'sim'), default='ca',
+                        help='PV backend: ca for Channel Access, sim for simulated PVs without IOC')
+    parser.add_argument('--no-pva', action='store_true', help='do not start the pvAccess plan server')
+    parser.add_argument('--log-file', default=None, help='log file name')
+    parser.add_argument('--time-startup', action='store_true',
+                        help='print the duration of each startup phase and exit')
+    parser.add_argument('--startup-timeout', type=float, default=60,
+                        help='seconds --time-startup waits for the tomoscan servers (default 60)')
+    args = parser.parse_args()
+    if (args.config is None) == (not args.pv_files):
+        parser.error('give either PV files or --config')
+    if args.config is not None:
+        configs = host.load_configs(args.config)
+    else:
+        configs = [(args.pv_files, parse_macros(args.macro))]
+
+    log.setup_custom_logger(args.log_file)
+
+    # Backends and NumPy are imported on first use, after this point
+    from scanlib import pvpool
+    pvpool.pool.set_backend(args.backend)
+    from scanlib.scanlib import ScanLib, STARTUP_PHASES
+    import_time = time.time() - tic
+
+    scanlib_host = host.ScanLibHost(configs, pva_server=not args.no_pva)
+    ts = scanlib_host[0]
+
+    if args.time_startup:
+        ready = scanlib_host.wait_ready(args.startup_timeout)
+        print('import: %3.3f s' % import_time)
+        for instance in scanlib_host:
+            print(scanlib_host.prefix(instance))
+            startup_times = dict(instance.startup_times)
+            for phase in STARTUP_PHASES:
+                if phase in startup_times:
+                    print('  %s: %3.3f s' % (phase, import_time + startup_times[phase]))
+                else:
+                    print('  %s: not completed after %3.3f s' % (phase, time.time() - tic))
+        print('numpy loaded before ready: %s' % ('numpy.core' in sys.modules or 'numpy._core' in sys.modules))
+        print(pvpool.pool.stats())
+        print(scanlib_host.stats())
+        return 0 if ready else 1
+
+    if args.config is None:
+        code.interact(banner='ScanLib object available as ts', local={'ts': ts})
+    else:
+        code.interact(banner='ScanLibHost available as host, its first ScanLib object as ts',
+                      local={'host': scanlib_host, 'ts': ts})
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+'''
+    Several ScanLib instances in one process
+
+    Each beamline station is a ScanLib instance with its own PV files and
+    macros. Hosting them in one process shares the channel access context
+    and the PV pool, the pvAccess server, the scheduler running the
+    watchdogs and the threads running the PV callbacks, so each station
+    added costs its PVs only.
+
+    The stations are listed in a JSON file, e.g.:
+
+    [
+        {"pv_files": ["../../db/scanLib_settings.req"], "macros": {"P": "2bmb:", "R": "ScanLib:"}},
+        {"pv_files": ["../../db/scanLib_settings.req"], "macros": {"P": "2bmb:", "R": "ScanLib2:"}}
+    ]
+'''
+import json
+import time
+
+from scanlib import log
+from scanlib import pvpool
+from scanlib import scheduler
+
+
+def macro_key(name):
+    """Returns the macro name as used in the PV files, e.g. P -> $(P)"""
+
+    return name if name.startswith('$(') else '$(%s)' % name
+
+
+def load_configs(fname):
+    """Reads the list of (pv_files, macros) configurations of a host file"""
+
+    with open(fname) as json_file:
+        entries = json.load(json_file)
+    configs = []
+    for entry in entries:
+        pv_files = entry['pv_files']
+        if not isinstance(pv_files, list):
+            pv_files = [pv_files]
+        macros = {macro_key(name): value for name, value in entry.get('macros', {}).items()}
+        configs.append((pv_files, macros))
+    return configs
+
+
+class ScanLibHost():
+    """ScanLib instances sharing the resources of one process.
+
+        Parameters
+        ----------
+        configs : list
+            (pv_files, macros) of each instance, see load_configs()
+        pva_server : bool
+            If True the plan and progress of each instance are served over pvAccess
+    """
+
+    def __init__(self, configs, pva_server=True):
+
+        # Imported here so the PV backend can be selected before ScanLib is loaded
+        from scanlib.scanlib import ScanLib
+
+        self.instances = []
+        for pv_files, macros in configs:
+            tic = time.time()
+            self.instances.append(ScanLib(pv_files, macros, pva_server=pva_server))
+            log.info('ScanLib %s started in %3.3f s', self.prefix(self.instances[-1]), time.time() - tic)
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __getitem__(self, index):
+        return self.instances[index]
+
+    def __iter__(self):
+        return iter(self.instances)
+
+    def prefix(self, instance):
+        """Returns the PV prefix of a ScanLib instance, e.g. 2bmb:ScanLib:"""
+
+        return instance.epics_pvs['StartScan'].pvname[:-len('StartScan')]
+
+    def wait_ready(self, timeout=None):
+        """Waits until every instance is connected to its tomoscan servers, returns False on timeout"""
+
+        deadline = None if timeout is None else time.time() + timeout
+        for instance in self.instances:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not instance.ready.wait(remaining):
+                return False
+        return True
+
+    def stats(self):
+        """Returns the number of instances, threads, scheduled tasks and PV channels of the process"""
+
+        stats = {'instances': len(self.instances),
+                 'ready': sum(instance.ready.is_set() for instance in self.instances)}
+        stats.update(scheduler.scheduler.stats())
+        stats['channels'] = pvpool.pool.stats()['channels']
+        return stats
+
+    def close(self):
+        """Stops the watchdogs and callbacks of all instances"""
+
+        for instance in self.instances:
+            instance.close()
@@ -0,0 +1,364 @@
+'''
+    Self-calibrating motion time model
+
+    Every move done with ``move()`` or ``move_axes()`` is timed and added to a per-axis,
+    per-direction model of the move time as a function of the distance:
+
+        t(d) = overhead + d / velocity + 2 * sqrt(d / acceleration)
+
+    The first two terms describe long moves at constant velocity, the
+    last one short moves that never reach full speed. The coefficients are
+    fitted online by least squares with exponential forgetting, so the
+    model follows changes of the motor settings, and saved to a JSON file
+    at most every SAVE_INTERVAL seconds so it survives restarts. The predicted time is used to scale the move
+    timeouts: a stuck motor is detected after a few expected move times
+    instead of a fixed ten minutes.
+
+    ``move_axes()`` starts the moves of several axes before waiting for
+    any of them, e.g. X and Y between mosaic tiles, and reports the time
+    saved compared to moving them one after the other.
+'''
+import os
+import json
+import time
+import threading
+
+from scanlib import log
+from scanlib import util
+from scanlib import pvpool
+from scanlib import preflight
+from scanlib import trace
+
+np = util.lazy_import('numpy')
+
+MODEL_FILE = os.path.join(os.path.expanduser('~'), '.scanlib', 'motion_model.json')
+
+# Timeout used until an axis has MIN_SAMPLES moves in the model
+DEFAULT_TIMEOUT = 600
+MIN_SAMPLES = 5
+# timeout = max(MIN_TIMEOUT, TIMEOUT_FACTOR * predicted time + TIMEOUT_MARGIN)
+MIN_TIMEOUT = 10
+TIMEOUT_FACTOR = 3
+TIMEOUT_MARGIN = 5
+# Weight of past moves, applied each time a new move is added
+FORGETTING = 0.99
+# Maximum time waited for the readback to reach the target after a move
+SETTLE_TIMEOUT = 1.0
+# Minimum time between two saves of the model file (s)
+SAVE_INTERVAL = 60
+
+
+def features(distance):
+    distance = abs(distance)
+    return np.array([1.0, distance, np.sqrt(distance)])
+
+
+class AxisModel():
+    """Least squares fit of the move time of one axis in one direction"""
+
+    def __init__(self, stats=None):
+
+        if stats is None:
+            self.ata = np.zeros((3, 3))
+            self.atb = np.zeros(3)
+            self.samples = 0
+            self.settle = 0.0
+        else:
+            self.ata = np.array(stats['ata'])
+            self.atb = np.array(stats['atb'])
+            self.samples = stats['samples']
+            self.settle = stats['settle']
+        self.solve()
+
+    def add(self, distance, duration, settle):
+        row = features(distance)
+        self.ata = FORGETTING * self.ata + np.outer(row, row)
+        self.atb = FORGETTING * self.atb + row * duration
+        self.settle = settle if self.samples == 0 else FORGETTING * self.settle + (1 - FORGETTING) * settle
+        self.samples += 1
+        self.solve()
+
+    def solve(self):
+        self.coefficients, *_ = np.linalg.lstsq(self.ata + 1e-9 * np.eye(3), self.atb, rcond=None)
+
+    def predict(self, distance):
+        if self.samples < MIN_SAMPLES:
+            return None
+        return max(float(features(distance) @ self.coefficients), 0.0) + self.settle
+
+    def parameters(self):
+        """Returns the fitted overhead (s), velocity (units/s) and acceleration (units/s^2)"""
+
+        overhead, per_unit, per_sqrt = self.coefficients
+        return {'overhead': float(overhead),
+                'velocity': float(1 / per_unit) if per_unit > 0 else None,
+                'acceleration': float(4 / per_sqrt**2) if per_sqrt > 0 else None,
+                'settle': self.settle,
+                'samples': self.samples}
+
+    def stats(self):
+        return {'ata': self.ata.tolist(), 'atb': self.atb.tolist(),
+                'samples': self.samples, 'settle': self.settle}
+
+
+class MotionModel():
+    """Move time models of all axes, keyed by PV name and direction.
+
+        Parameters
+        ----------
+        fname : str
+            JSON file the models are loaded from and saved to, None to keep
+            them in memory only
+    """
+
+    def __init__(self, fname=MODEL_FILE):
+
+        self.fname = fname
+        self.lock = threading.Lock()
+        self._axes = None
+        self.dirty = False
+        self.saved = time.monotonic()
+
+    @property
+    def axes(self):
+        """Models keyed by axis and direction, loaded from fname on first use"""
+
+        if self._axes is None:
+            self._axes = {}
+            if self.fname is not None and os.path.isfile(self.fname):
+                try:
+                    with open(self.fname) as json_file:
+                        stats = json.load(json_file)
+                    self._axes = {key: AxisModel(value) for key, value in stats.items()}
+                except (ValueError, KeyError) as e:
+                    log.error('motion model %s is not correctly formatted: %s', self.fname, e)
+        return self._axes
+
+    def key(self, axis, distance):
+        return '%s:%s' % (axis, '+' if distance >= 0 else '-')
+
+    def record(self, axis, distance, duration, settle=0.0):
+        """Adds a timed move of distance to the model of axis, saving the model if it is due"""
+
+        with self.lock:
+            key = self.key(axis, distance)
+            if key not in self.axes:
+                self.axes[key] = AxisModel()
+            self.axes[key].add(distance, duration, settle)
+            self.dirty = True
+            due = time.monotonic() - self.saved >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def predict(self, axis, distance):
+        """Returns the expected duration in s of a move, None if the axis is not calibrated yet"""
+
+        with self.lock:
+            axis_model = self.axes.get(self.key(axis, distance))
+            return axis_model.predict(distance) if axis_model is not None else None
+
+    def timeout(self, axis, distance):
+        """Returns the timeout to use for a move, scaled to its expected duration"""
+
+        predicted = self.predict(axis, distance)
+        if predicted is None:
+            return DEFAULT_TIMEOUT
+        return max(MIN_TIMEOUT, TIMEOUT_FACTOR * predicted + TIMEOUT_MARGIN)
+
+    def parameters(self):
+        """Returns the fitted parameters of every axis and direction"""
+
+        with self.lock:
+            return {key: axis_model.parameters() for key, axis_model in self.axes.items()}
+
+    def save(self):
+        """Writes the models to fname if they changed since the last save.
+
+        The models are written to a temporary file renamed over fname, so a
+        reader or a crash never sees a partly written file.
+        """
+
+        if self.fname is None:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            stats = {key: axis_model.stats() for key, axis_model in self.axes.items()}
+            temporary = '%s.%d.tmp' % (self.fname, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+                with open(temporary, 'w') as json_file:
+                    json.dump(stats, json_file)
+                os.replace(temporary, self.fname)
+                self.dirty = False
+            except OSError as e:
+                log.error('cannot save motion model %s: %s', self.fname, e)
+            self.saved = time.monotonic()
+
+
+model = MotionModel()
+
+
+def settle_time(readback, target, tolerance):
+    """Waits for readback to be within tolerance of target, returns the time waited"""
+
+    tic = time.time()
+    while time.time() - tic < SETTLE_TIMEOUT:
+        value = readback.get(use_monitor=False)
+        if value is None or abs(value - target) <= tolerance:
+            break
+        time.sleep(0.01)
+    return time.time() - tic
+
+
+class MoveResult():
+    """Outcome of a coordinated move of several axes.
+
+        Attributes
+        ----------
+        ok : bool
+            True if every axis completed its move before its timeout
+        moved : list
+            Names of the axes moved
+        skipped : list
+            Names of the axes already at their target
+        wall_time : float
+            Time from the start of the moves to the last axis settled (s)
+        axis_time : float
+            Sum of the move and settle times of the motors moved (s), the
+            time the same moves would take one after the other
+    """
+
+    def __init__(self):
+
+        self.ok = True
+        self.moved = []
+        self.skipped = []
+        self.wall_time = 0.0
+        self.axis_time = 0.0
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def saved(self):
+        """Time saved by moving the axes together instead of one after the other (s)"""
+
+        return max(self.axis_time - self.wall_time, 0.0)
+
+
+def at_target(epics_pv, position, readback, tolerance):
+    """True if epics_pv and its readback are already within tolerance of position"""
+
+    for value in (epics_pv.get(), readback.get() if readback is not None else position):
+        if value is None or abs(value - position) > tolerance:
+            return False
+    return True
+
+
+def move_axes(moves, tolerance=1e-3):
+    """Moves several axes at the same time, timing each move and updating the model.
+
+    All the moves are started before waiting for any of them, so the
+    duration is that of the slowest axis instead of the sum of all axes.
+    Axes already within tolerance of their target are not moved.
+
+    Parameters
+    ----------
+    moves : list
+        (PV, position, readback PV or None) of each axis. Only the axes
+        with a readback, i.e. motors, are timed and added to the model.
+    tolerance : float
+        Distance from the target at which an axis is settled
+
+    Returns
+    -------
+    MoveResult
+    """
+
+    result = MoveResult()
+    started = []
+    tic = time.time()
+    for epics_pv, position, readback in moves:
+        if at_target(epics_pv, position, readback, tolerance):
+            result.skipped.append(epics_pv.pvname)
+            continue
+        start = epics_pv.get()
+        distance = position - start if start is not None else 0.0
+        done = threading.Event()
+        axis = {'pv': epics_pv, 'position': position, 'readback': readback, 'start': start,
+                'distance': distance, 'timeout': model.timeout(epics_pv.pvname, distance),
+                'done': done, 'tic': time.time(), 'duration': None,
+                'thread': '%s move %s' % (threading.current_thread().name, epics_pv.pvname)}
+        if epics_pv.put(position, callback=lambda axis=axis, **kwargs: complete(axis)) is None:
+            log.error('%s is not connected, not moved to %3.3f', epics_pv.pvname, position)
+            result.ok = False
+            continue
+        started.append(axis)
+    for axis in started:
+        if not axis['done'].wait(max(axis['tic'] + axis['timeout'] - time.time(), 0)):
+            log.error('%s did not reach %3.3f within %3.1f s', axis['pv'].pvname, axis['position'], axis['timeout'])
+            result.ok = False
+    for axis in started:
+        if axis['duration'] is None:
+            continue
+        result.moved.append(axis['pv'].pvname)
+        if axis['readback'] is None:
+            # Not a motor, e.g. a tomoscan parameter: the put is not a move to time
+            continue
+        settle = settle_time(axis['readback'], axis['position'], tolerance)
+        # Axes settling while an earlier one was waited for are not charged for that wait
+        settle = max(min(settle, time.time() - axis['tic'] - axis['duration']), 0.0)
+        if axis['start'] is not None:
+            model.record(axis['pv'].pvname, axis['distance'], axis['duration'], settle)
+        result.axis_time += axis['duration'] + settle
+        log.debug('%s moved %3.3f in %3.3f s (settle %3.3f s)', axis['pv'].pvname, axis['distance'],
+                  axis['duration'], settle)
+    result.wall_time = time.time() - tic
+    if len(result.moved) > 1:
+        log.info('moved %s together in %3.3f s, saved %3.3f s', ', '.join(result.moved),
+                 result.wall_time, result.saved)
+    return result
+
+
+def complete(axis):
+    """Put completion callback of move_axes()"""
+
+    end = time.time()
+    axis['duration'] = end - axis['tic']
+    # The put returns at once, so the whole move is recorded as a put_wait. Each axis
+    # gets a time line of its own so a replay keeps the moves concurrent.
+    if trace.recorder.enabled:
+        trace.recorder.record('put_wait', axis['pv'].pvname, axis['position'], axis['tic'], end,
+                              thread=axis['thread'])
+    axis['done'].set()
+
+
+def move(epics_pv, position, readback=None, tolerance=1e-3):
+    """Moves epics_pv to position, timing the move and updating the model.
+
+    Parameters
+    ----------
+    epics_pv : PV
+        PV to write, its name identifies the axis in the model
+    position : float
+        Target position
+    readback : PV
+        Readback of the axis, used to measure the settle time, None if
+        epics_pv is not a motor and the move is not to be timed
+    tolerance : float
+        Distance from the target at which the axis is settled
+
+    Returns
+    -------
+    bool
+        True if the move completed before the timeout.
+    """
+
+    return move_axes([(epics_pv, position, readback)], tolerance).ok
+
+
+def motor_readback(motor_pv):
+    """Returns the pooled readback (RBV) PV of a motor record PV"""
+
+    return pvpool.get_pv(preflight.motor_record(motor_pv.pvname) + '.RBV')
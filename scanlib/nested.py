@@ -0,0 +1,189 @@
+'''
+    Generic N-dimensional nested scans
+
+    A nested scan is a list of axes (motor positions, energy, in-situ set
+    point, repetition, ...). Steps are generated lazily, one at a time, so
+    the full product of the axes is never stored in memory. Unless a fixed
+    order is given, the axes are nested so that slow axes (large cost per
+    change) change as few times as possible.
+'''
+import math
+import threading
+
+from scanlib import log
+
+
+class Axis():
+    """One axis of a nested scan.
+
+        Parameters
+        ----------
+        name : str
+            Axis name, used in the step positions
+        positions : sequence
+            Values of the axis, anything supporting len() and indexing
+            (list, range, numpy array)
+        setter : callable
+            Called with the new value each time the axis changes, None for
+            axes that only label the steps (e.g. repetitions)
+        cost : float
+            Expected time in seconds to change the axis value
+
+    A setter that waits, like the one of repeat_axis(), waits on the stop
+    event of the axis so that the wait can be cut short. A Nested plan
+    replaces it with the stop event of its future.
+    """
+
+    def __init__(self, name, positions, setter=None, cost=0.0):
+
+        self.name = name
+        self.positions = positions
+        self.setter = setter
+        self.cost = cost
+        self.stop = threading.Event()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self):
+        return 'Axis(%s, %d positions, cost=%.3g)' % (self.name, len(self), self.cost)
+
+
+def pv_axis(name, epics_pv, positions, cost=1.0, timeout=600):
+    """Returns an axis that puts each value to epics_pv and waits for completion.
+
+    The setter raises RuntimeError if the put does not complete.
+    """
+
+    def setter(value):
+        status = epics_pv.put(value, wait=True, timeout=timeout)
+        if status != 1:
+            raise RuntimeError('put %s = %s not completed (status %s)' % (epics_pv.pvname, value, status))
+    return Axis(name, positions, setter, cost)
+
+
+def repeat_axis(repeats, sleep_time=0):
+    """Returns an axis repeating the inner axes, waiting sleep_time between repeats"""
+
+    def setter(value):
+        if value > 0 and sleep_time > 0:
+            log.warning('wait (s): %s ', str(sleep_time))
+            axis.stop.wait(sleep_time)
+    axis = Axis('Repeat', range(int(repeats)), setter, sleep_time)
+    return axis
+
+
+def change_cost(axes):
+    """Returns the total time spent changing axes for axes nested outer first"""
+
+    cost = 0.0
+    changes = 1
+    for axis in axes:
+        changes *= len(axis)
+        cost += changes * axis.cost
+    return cost
+
+
+def nesting_order(axes):
+    """Returns the axes sorted outer first to minimise change_cost().
+
+    Swapping two neighbouring axes a, b only changes their own cost, and a
+    belongs outside b when a.cost * n_a / (n_a - 1) > b.cost * n_b / (n_b - 1),
+    so sorting on that key gives the optimal nesting.
+    """
+
+    def key(axis):
+        if len(axis) <= 1:
+            return math.inf
+        return axis.cost * len(axis) / (len(axis) - 1)
+    return sorted(axes, key=key, reverse=True)
+
+
+class NestedScan():
+    """Lazy generator of the steps of a nested scan.
+
+        Parameters
+        ----------
+        axes : list
+            Axis objects
+        order : str or list
+            'auto' to choose the nesting with the lowest change_cost(),
+            otherwise the axis names from outermost to innermost
+    """
+
+    def __init__(self, axes, order='auto'):
+
+        if order == 'auto':
+            self.axes = nesting_order(axes)
+        else:
+            by_name = {axis.name: axis for axis in axes}
+            if sorted(order) != sorted(by_name):
+                raise ValueError('order %s does not match axes %s' % (order, list(by_name)))
+            self.axes = [by_name[name] for name in order]
+
+    def __len__(self):
+        return math.prod(len(axis) for axis in self.axes)
+
+    @property
+    def order(self):
+        return [axis.name for axis in self.axes]
+
+    def cost(self):
+        return change_cost(self.axes)
+
+    def __iter__(self):
+        """Yields one dictionary per step with keys:
+
+        - index : step number
+        - positions : axis name -> value
+        - changed : names of the axes that changed since the previous step,
+          outermost first
+        """
+
+        if len(self) == 0:
+            return
+        counters = [0] * len(self.axes)
+        positions = {axis.name: axis.positions[0] for axis in self.axes}
+        changed = [axis.name for axis in self.axes]
+        for index in range(len(self)):
+            yield {'index': index, 'positions': dict(positions), 'changed': changed}
+            # Advance the innermost axis, carrying into the outer ones
+            for level in reversed(range(len(self.axes))):
+                axis = self.axes[level]
+                counters[level] = (counters[level] + 1) % len(axis)
+                positions[axis.name] = axis.positions[counters[level]]
+                if counters[level] != 0:
+                    break
+            changed = [axis.name for axis in self.axes[level:]]
+
+    def set_axes(self, step):
+        """Calls the setters of the axes changed by step, outermost first"""
+
+        for axis in self.axes:
+            if axis.name in step['changed'] and axis.setter is not None:
+                log.warning('%s position: %s', axis.name, step['positions'][axis.name])
+                axis.setter(step['positions'][axis.name])
+
+    def run(self, step_function, is_running=None):
+        """Executes the scan.
+
+        For each step the setters of the changed axes are called, outermost
+        first, then step_function(step) is called. An exception raised by
+        a setter stops the scan.
+
+        Parameters
+        ----------
+        step_function : callable
+            Called with the step dictionary once all axes are set
+        is_running : callable
+            Checked before each step, the scan stops when it returns False
+        """
+
+        log.info('nested scan: %d steps, order %s, estimated axis change time %3.3f s',
+                 len(self), self.order, self.cost())
+        for step in self:
+            if is_running is not None and not is_running():
+                log.warning('nested scan stopped at step %d', step['index'])
+                return
+            self.set_axes(step)
+            step_function(step)
@@ -0,0 +1,297 @@
+'''
+    Scan plans, futures and the plan queue
+
+    A plan is a complete description of a scan: its type, the table of
+    single scans to run, the repetitions and the tomoscan stations it uses.
+    Submitting a plan returns a ScanFuture at once. The future streams the
+    progress events of the plan, can be cancelled, waited for with
+    result() or awaited from asyncio.
+
+    Plans are run by a PlanQueue in submission order. Plans that use
+    different stations run at the same time, a plan that needs a station
+    in use waits for it.
+'''
+import time
+import queue
+import asyncio
+import threading
+import concurrent.futures
+
+from scanlib import log
+
+# Scan types, the ScanLib ScanType PV choices and Nested, a nested scan of single scans
+KINDS = ('Single', 'Vertical', 'Horizontal', 'Mosaic', 'Scan File', 'Energy File', 'Nested')
+
+# Plan states reported in the last event and in the result
+FINAL_STATES = ('Done', 'Failed', 'Cancelled')
+
+
+class Plan():
+    """A scan to run.
+
+        Parameters
+        ----------
+        kind : str
+            Scan type, one of KINDS
+        table : ScanTable
+            One entry per single scan, None for a Nested plan. Stage columns are named after the
+            tomoscan PV they are written to without the 'TS', e.g. SampleX
+            or SampleInY, and an Energy column sets the energy.
+        stations : list
+            Stations used by the plan, the first one runs the single scans
+            and all of them share the entries of a Scan File plan
+        repeats : int
+            Number of times the whole table is run
+        sleep_time : float
+            Seconds to wait between repeats
+        testing : bool
+            If True the stage is moved but no scan is started
+        insitu : tuple
+            (start, step size) of the in-situ set point logged between
+            repeats, None if not used
+        nested : NestedScan
+            Axes of a Nested plan, set before the single scan of each
+            step. Its steps are never materialised, step i has the key
+            Nested_i.
+    """
+
+    def __init__(self, kind, table, stations, repeats=1, sleep_time=0, testing=False, insitu=None,
+                 nested=None):
+
+        if kind not in KINDS:
+            raise ValueError('unknown scan type %s, use one of %s' % (kind, list(KINDS)))
+        if not stations:
+            raise ValueError('a plan needs at least one station')
+        self.kind = kind
+        self.table = table
+        self.stations = list(stations)
+        self.repeats = max(int(repeats), 1)
+        self.sleep_time = sleep_time
+        self.testing = testing
+        self.insitu = insitu
+        self.nested = nested
+        if (kind == 'Nested') != (nested is not None):
+            raise ValueError('a Nested plan needs nested axes, other plans none')
+
+    def __repr__(self):
+        return 'Plan(%s, %d steps x %d, %s)' % (self.kind, self.steps, self.repeats,
+                                               ', '.join(s.tomoscan_prefix for s in self.stations))
+
+    def __len__(self):
+        return self.steps * self.repeats
+
+    @property
+    def steps(self):
+        """Number of single scans of one repeat"""
+
+        return len(self.nested) if self.nested is not None else len(self.table)
+
+    @property
+    def scan_type(self):
+        """tomoscan ScanType of the plan, the steps of a Nested plan are single scans"""
+
+        return 'Single' if self.kind == 'Nested' else self.kind
+
+    @property
+    def resources(self):
+        """Prefixes of the stations the plan needs for itself"""
+
+        return {scan_station.tomoscan_prefix for scan_station in self.stations}
+
+
+class ScanFuture(concurrent.futures.Future):
+    """Future of a submitted plan.
+
+    The result is a dictionary with the final 'state' (Done, Failed or
+    Cancelled), the number of 'steps' done, the keys of the 'failed'
+    steps and of the 'skipped' steps that were not run. The skipped steps
+    of a Nested plan are given as a 'Nested_<first>..Nested_<last>' range.
+    Progress events are dictionaries with the 'state' of the plan or step,
+    the step 'key', 'index' and 'total', the 'station' and the 'time'.
+
+        Parameters
+        ----------
+        plan : Plan
+            Plan run by this future
+    """
+
+    def __init__(self, plan):
+
+        super().__init__()
+        self.plan = plan
+        self.stop = threading.Event()
+        self.listeners = []
+        self.queues = []
+        self.history = []
+        self.lock = threading.Lock()
+        self.abort = None
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+    def cancel(self):
+        """Cancels the plan.
+
+        A pending plan is removed from the queue, a running plan stops after
+        aborting the current scan of its stations.
+
+        Returns
+        -------
+        bool
+            False if the plan has already finished.
+        """
+
+        if super().cancel():
+            self.publish('Cancelled')
+            return True
+        if self.done():
+            return False
+        self.stop.set()
+        if self.abort is not None:
+            self.abort()
+        return True
+
+    def is_active(self):
+        """False once the plan has been cancelled"""
+
+        return not self.stop.is_set()
+
+    def add_listener(self, listener):
+        """Calls listener(event) for every progress event, past events first"""
+
+        with self.lock:
+            history = list(self.history)
+            self.listeners.append(listener)
+        for event in history:
+            listener(event)
+
+    def publish(self, state, key=None, index=None, scan_station=None):
+        """Sends a progress event to the listeners and the event streams"""
+
+        event = {'state': state, 'key': key, 'index': index, 'total': len(self.plan),
+                 'station': scan_station.tomoscan_prefix if scan_station is not None else None,
+                 'time': time.time()}
+        with self.lock:
+            self.history.append(event)
+            listeners = list(self.listeners)
+            queues = list(self.queues)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                log.error('progress listener failed: %s', e)
+        for event_queue in queues:
+            event_queue.put(event)
+
+    def events(self, timeout=None):
+        """Yields the progress events of the plan, past events first, until it finishes.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait for the next event, None to wait forever
+        """
+
+        event_queue = queue.Queue()
+        with self.lock:
+            history = list(self.history)
+            self.queues.append(event_queue)
+        try:
+            for event in history:
+                yield event
+                if event['key'] is None and event['state'] in FINAL_STATES:
+                    return
+            if self.cancelled():
+                return
+            while True:
+                event = event_queue.get(timeout=timeout)
+                yield event
+                if event['key'] is None and event['state'] in FINAL_STATES:
+                    return
+        finally:
+            with self.lock:
+                self.queues.remove(event_queue)
+
+
+class PlanQueue():
+    """Runs submitted plans in order, at the same time when they use different stations.
+
+        Parameters
+        ----------
+        runner : callable
+            Called as runner(plan, future) in a thread of its own, returns
+            the result of the future
+    """
+
+    def __init__(self, runner):
+
+        self.runner = runner
+        self.lock = threading.Lock()
+        self.pending = []
+        self.running = []
+
+    def submit(self, plan):
+        """Queues plan and returns its ScanFuture"""
+
+        future = ScanFuture(plan)
+        # A cancelled pending plan may have held back later plans
+        future.add_done_callback(lambda done: self.schedule() if done.cancelled() else None)
+        with self.lock:
+            self.pending.append(future)
+        log.info('queued %s', plan)
+        self.schedule()
+        return future
+
+    def schedule(self):
+        """Starts the pending plans whose stations are free"""
+
+        with self.lock:
+            busy = set()
+            for future in self.running:
+                busy |= future.plan.resources
+            started = []
+            for future in list(self.pending):
+                if future.cancelled():
+                    self.pending.remove(future)
+                    continue
+                if future.plan.resources & busy:
+                    # Later plans needing the same stations keep their order
+                    busy |= future.plan.resources
+                    continue
+                busy |= future.plan.resources
+                self.pending.remove(future)
+                self.running.append(future)
+                started.append(future)
+        for future in started:
+            thread = threading.Thread(target=self.run, args=(future,), daemon=True)
+            thread.start()
+
+    def run(self, future):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.runner(future.plan, future))
+                except Exception as e:
+                    log.error('%s failed: %s', future.plan, e)
+                    future.publish('Failed')
+                    future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running.remove(future)
+            self.schedule()
+
+    def cancel_all(self):
+        """Cancels the pending and running plans"""
+
+        with self.lock:
+            futures = self.pending + self.running
+        for future in futures:
+            future.cancel()
+        self.schedule()
+
+    def status(self):
+        """Returns the pending and running plans"""
+
+        with self.lock:
+            return {'pending': [future.plan for future in self.pending],
+                    'running': [future.plan for future in self.running]}
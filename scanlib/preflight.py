@@ -0,0 +1,133 @@
+'''
+    Whole plan preflight validation
+
+    Before the first move, every position of the plan is checked against
+    the soft limits of the sample stage motors and every enum parameter
+    against the choices of the tomoscan PV it is written to. Limits and
+    choices are read in one batch and the checks are vectorized over the
+    whole plan, so all the violations are reported at once.
+'''
+from scanlib import log
+from scanlib import pvpool
+from scanlib import util
+from scanlib import scanfile
+
+np = util.lazy_import('numpy')
+
+# Plan columns that move each sample stage motor
+MOTOR_COLUMNS = {
+    'TSSampleX': ('SampleX', 'SampleInX', 'SampleOutX'),
+    'TSSampleY': ('SampleY', 'SampleInY', 'SampleOutY'),
+}
+
+# Maximum number of violations listed one by one in the log
+MAX_LOGGED = 100
+
+
+def motor_record(pvname):
+    """Returns the motor record name of a motor PV name, e.g. 2bmb:m63.VAL -> 2bmb:m63"""
+
+    return pvname.split('.')[0]
+
+
+def read_limits(epics_pvs, timeout=1.0):
+    """Reads the soft limits of the sample stage motors in one batch.
+
+    All the limit channels are created before the first read so they
+    connect in parallel.
+
+    Returns
+    -------
+    dict
+        PV key -> (low limit, high limit), (None, None) if the limits are
+        not set (both 0), None if they could not be read.
+    """
+
+    keys = [key for key in MOTOR_COLUMNS if key in epics_pvs]
+    limit_pvs = []
+    for key in keys:
+        record = motor_record(epics_pvs[key].pvname)
+        limit_pvs += [pvpool.get_pv(record + '.LLM'), pvpool.get_pv(record + '.HLM')]
+    values = [limit_pv.get(timeout=timeout) for limit_pv in limit_pvs]
+    limits = {}
+    for index, key in enumerate(keys):
+        low, high = values[2*index], values[2*index + 1]
+        if low is None or high is None:
+            limits[key] = None
+        elif low == high == 0:
+            limits[key] = (None, None)
+        else:
+            limits[key] = (low, high)
+    return limits
+
+
+def read_choices(epics_pvs):
+    """Returns the enum choices of the tomoscan PVs set by the string parameters"""
+
+    choices = {}
+    for name in scanfile.STRING_PARAMS:
+        epics_pv = epics_pvs.get('TS' + name)
+        if epics_pv is None or not epics_pv.connected:
+            continue
+        if epics_pv.enum_strs:
+            choices[name] = [str(choice) for choice in epics_pv.enum_strs]
+    return choices
+
+
+def check(plan, limits, choices):
+    """Checks every entry of the plan at once.
+
+    Parameters
+    ----------
+    plan : ScanTable
+        Planned positions and parameters
+    limits : dict
+        Motor PV key -> (low, high), as returned by read_limits(). A plan
+        moving a motor whose limits could not be read (None) is a violation.
+    choices : dict
+        Parameter name -> allowed strings, as returned by read_choices()
+
+    Returns
+    -------
+    list
+        One message per violation.
+    """
+
+    errors = []
+    for key, columns in MOTOR_COLUMNS.items():
+        if key in limits and limits[key] is None:
+            used = [name for name in columns if name in plan]
+            if used:
+                errors.append('%s: limits of %s could not be read' % (', '.join(used), key))
+            continue
+        low, high = limits.get(key, (None, None))
+        if low is None:
+            continue
+        for name in columns:
+            if name not in plan:
+                continue
+            values = np.asarray(plan[name], dtype=float)
+            for index in np.flatnonzero((values < low) | (values > high)):
+                errors.append('%s: %s = %3.3f outside motor limits [%3.3f, %3.3f]'
+                              % (plan.keys[index], name, values[index], low, high))
+    for name, allowed in choices.items():
+        if name not in plan:
+            continue
+        values = np.asarray(plan[name]).astype(str)
+        for index in np.flatnonzero(~np.isin(values, allowed)):
+            errors.append('%s: %s = %s not in %s' % (plan.keys[index], name, values[index], allowed))
+    return errors
+
+
+def report(errors, status_pv=None):
+    """Logs the violations and writes a summary to status_pv"""
+
+    for error in errors[:MAX_LOGGED]:
+        log.error('preflight: %s', error)
+    if len(errors) > MAX_LOGGED:
+        log.error('preflight: %d more violations not shown', len(errors) - MAX_LOGGED)
+    if status_pv is not None:
+        if errors:
+            status_pv.put(('Preflight: %d violations; %s' % (len(errors), errors[0]))[:255])
+        else:
+            status_pv.put('Preflight OK')
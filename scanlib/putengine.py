@@ -0,0 +1,228 @@
+'''
+    Concurrent PV put engine
+
+    Writes a batch of PVs at once with a bounded number of puts in flight.
+    Each put waits for completion, failed puts (timeout, disconnection or
+    CA error) are retried with an exponential backoff and, when
+    confirmation is requested, the value is read back and compared to the
+    value written. The outcome of the whole batch is returned as one
+    BatchResult, so a stale tomoscan parameter stops the scan instead of
+    going unnoticed.
+'''
+import time
+import threading
+import concurrent.futures
+
+from scanlib import log
+
+# Maximum number of puts in flight
+MAX_WORKERS = 8
+# Number of retries of a failed put and delay before the first retry (s),
+# doubled at each retry
+RETRIES = 2
+BACKOFF = 0.2
+# Completion timeout of each put (s)
+PUT_TIMEOUT = 30.0
+# Absolute tolerance of the confirmation of numeric values
+TOLERANCE = 1e-6
+
+
+class PutResult():
+    """Outcome of the write of one PV.
+
+        Attributes
+        ----------
+        pvname : str
+        value
+            Value written
+        ok : bool
+            True if the put completed and, if requested, was confirmed
+        attempts : int
+            Number of puts done
+        readback
+            Value read back by the confirmation, None if not confirmed
+        error : str
+            Reason of the last failure, None if ok
+        elapsed : float
+            Time spent on this PV including retries (s)
+    """
+
+    def __init__(self, pvname, value):
+
+        self.pvname = pvname
+        self.value = value
+        self.ok = False
+        self.attempts = 0
+        self.readback = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        if self.ok:
+            return 'PutResult(%s=%s, ok)' % (self.pvname, self.value)
+        return 'PutResult(%s=%s, %s after %d attempts)' % (self.pvname, self.value, self.error, self.attempts)
+
+
+class BatchResult():
+    """Outcome of a batch of puts, one PutResult per PV in submission order"""
+
+    def __init__(self, results, elapsed):
+
+        self.results = results
+        self.elapsed = elapsed
+
+    def __bool__(self):
+        return self.ok
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.results)
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def retries(self):
+        return sum(result.attempts - 1 for result in self.results if result.attempts > 1)
+
+    def summary(self):
+        """Returns a one line description of the batch"""
+
+        failed = self.failed
+        text = '%d/%d puts ok in %3.3f s' % (len(self) - len(failed), len(self), self.elapsed)
+        if self.retries:
+            text += ', %d retries' % self.retries
+        if failed:
+            text += '; failed: ' + ', '.join('%s (%s)' % (result.pvname, result.error) for result in failed)
+        return text
+
+
+def matches(value, readback, tolerance=TOLERANCE):
+    """True if readback equals the value written, within tolerance for numbers"""
+
+    if readback is None:
+        return False
+    if isinstance(value, str):
+        return str(readback).strip() == value.strip()
+    try:
+        return abs(float(readback) - float(value)) <= tolerance
+    except (TypeError, ValueError):
+        return False
+
+
+class PutEngine():
+    """Writes batches of PVs in parallel with retries and confirmation.
+
+        Parameters
+        ----------
+        max_workers : int
+            Maximum number of puts in flight
+        retries : int
+            Number of retries of a failed put
+        backoff : float
+            Delay before the first retry (s), doubled at each retry
+        timeout : float
+            Completion timeout of each put (s)
+        confirm : bool
+            If True each value is read back and compared to the value written
+        tolerance : float
+            Absolute tolerance of the numeric confirmation
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, retries=RETRIES, backoff=BACKOFF,
+                 timeout=PUT_TIMEOUT, confirm=False, tolerance=TOLERANCE):
+
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.confirm = confirm
+        self.tolerance = tolerance
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='scanlib-put')
+            return self.executor
+
+    def put_one(self, epics_pv, value, confirm):
+        """Writes value to epics_pv, retrying until it succeeds or retries are exhausted"""
+
+        result = PutResult(epics_pv.pvname, value)
+        tic = time.time()
+        delay = self.backoff
+        while result.attempts <= self.retries:
+            if result.attempts > 0:
+                log.warning('retrying put %s = %s in %3.3f s: %s', result.pvname, value, delay, result.error)
+                time.sleep(delay)
+                delay *= 2
+            result.attempts += 1
+            try:
+                status = epics_pv.put(value, wait=True, timeout=self.timeout)
+            except Exception as e:
+                result.error = 'put error: %s' % e
+                continue
+            if status is None:
+                result.error = 'not connected'
+                continue
+            if status != 1:
+                result.error = 'put not completed' if status == -1 else 'put failed (status %s)' % status
+                continue
+            if confirm:
+                try:
+                    result.readback = epics_pv.get(as_string=isinstance(value, str), use_monitor=False)
+                except Exception as e:
+                    result.error = 'readback error: %s' % e
+                    continue
+                if not matches(value, result.readback, self.tolerance):
+                    result.error = 'readback %s' % result.readback
+                    continue
+            result.ok = True
+            result.error = None
+            break
+        result.elapsed = time.time() - tic
+        return result
+
+    def put_batch(self, writes, confirm=None):
+        """Writes a batch of PVs and waits for all of them.
+
+        Parameters
+        ----------
+        writes : iterable
+            (PV, value) pairs
+        confirm : bool
+            Overrides the confirm setting of the engine for this batch
+
+        Returns
+        -------
+        BatchResult
+        """
+
+        confirm = self.confirm if confirm is None else confirm
+        writes = list(writes)
+        tic = time.time()
+        if len(writes) == 1:
+            results = [self.put_one(writes[0][0], writes[0][1], confirm)]
+        else:
+            executor = self.get_executor()
+            futures = [executor.submit(self.put_one, epics_pv, value, confirm) for epics_pv, value in writes]
+            results = [future.result() for future in futures]
+        batch = BatchResult(results, time.time() - tic)
+        log.debug('put batch: %s', batch.summary())
+        return batch
+
+
+engine = PutEngine()
+
+
+def put_batch(writes, confirm=None):
+    """Writes a batch of PVs with the process-wide engine, see PutEngine.put_batch"""
+
+    return engine.put_batch(writes, confirm)
@@ -0,0 +1,328 @@
+'''
+    pvAccess server publishing the ScanLib plan and progress
+
+    The channels, served with the same prefix as the ScanLib PVs, are:
+
+    - Progress : current step, number of steps, elapsed time, ETA and
+      state of the plan, and the key, state, duration and actual
+      positions of the last step started or finished. It is published at
+      every step and its size does not depend on the number of steps.
+    - Plan : NTTable with one row per step, holding the step key, the
+      planned positions and parameters (PLAN_COLUMNS) and the step state.
+    - PlannedPositions, ActualPositions : NTNDArray of the sample stage
+      positions, one row per step, one column per axis (POSITION_AXES).
+      Actual positions are NaN until the step is done.
+
+    The Plan table and ActualPositions hold the whole plan, so during a
+    plan they are republished at most every PUBLISH_PERIOD and so that
+    republishing takes at most PUBLISH_LOAD of the run time. They are
+    always published when a plan starts and when it finishes.
+
+    Clients can subscribe to these channels instead of polling CA PVs.
+    Each tomoscan station has its own channels, the first one with the
+    ScanLib prefix and the others with the prefix followed by their key,
+    e.g. 2bmb:ScanLib:Tomoscan2:Plan. All the ScanLib instances of a
+    process serve their channels from one pvAccess server.
+'''
+import time
+import threading
+
+from scanlib import util
+from scanlib import preflight
+from scanlib import scanfile
+
+np = util.lazy_import('numpy')
+pva = util.lazy_import('pvaccess')
+
+# Columns of the position arrays, each filled from the plan columns moving that motor
+POSITION_AXES = ('TSSampleX', 'TSSampleY')
+
+# Columns of the Plan table, the same for every plan so monitors of the
+# channel survive a new plan. Columns the plan does not set are empty
+# strings or NaN.
+PLAN_COLUMNS = scanfile.SCAN_PARAMS + ('Energy',)
+
+# Minimum time between two publications of the Plan table and
+# ActualPositions during a plan (s), and maximum fraction of the run time
+# spent republishing them
+PUBLISH_PERIOD = 1.0
+PUBLISH_LOAD = 0.01
+
+server = None
+server_lock = threading.Lock()
+
+
+def shared_server():
+    """Returns the pvAccess server of the process, started on first use.
+
+    All the PlanServer instances of a process add their channels to this
+    server.
+    """
+
+    global server
+    with server_lock:
+        if server is None:
+            server = pva.PvaServer()
+        return server
+
+
+def progress_structure():
+    return {
+        'index': pva.INT,
+        'total': pva.INT,
+        'elapsed': pva.DOUBLE,
+        'eta': pva.DOUBLE,
+        'state': pva.STRING,
+        'key': pva.STRING,
+        'stepState': pva.STRING,
+        'stepDuration': pva.DOUBLE,
+        'actualPositions': [pva.DOUBLE],
+    }
+
+
+def plan_structure():
+    structure = {'Key': [pva.STRING]}
+    for name in PLAN_COLUMNS:
+        structure[name] = [pva.STRING] if name in scanfile.STRING_PARAMS else [pva.DOUBLE]
+    structure['State'] = [pva.STRING]
+    return structure
+
+
+def nd_array(array, descriptor):
+    """Returns a 2D numpy array as an NTNDArray, x (columns) varying fastest"""
+
+    nt_nd_array = pva.NtNdArray()
+    nt_nd_array['value'] = {util.type_dict[array.dtype.name]: array.ravel()}
+    nt_nd_array['dimension'] = [pva.PvDimension(size, 0, size, 1, False)
+                                for size in reversed(array.shape)]
+    nt_nd_array['descriptor'] = descriptor
+    return nt_nd_array
+
+
+class PlanServer():
+    """Serves the plan and progress of a ScanLib instance over pvAccess.
+
+        Parameters
+        ----------
+        prefix : str
+            Channel name prefix, e.g. 2bmb:ScanLib:
+    """
+
+    def __init__(self, prefix):
+
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.server = shared_server()
+        self.plan = None
+        self.indices = {}
+        self.states = np.array([], dtype=object)
+        self.planned = np.zeros((0, len(POSITION_AXES)))
+        self.actual = np.zeros((0, len(POSITION_AXES)))
+        self.total = 0
+        self.done = 0
+        self.next_index = 0
+        self.current = None
+        self.started = None
+        self.step_starts = {}
+        self.published = 0.0
+        self.publish_cost = 0.0
+        self.dirty = False
+        self.progress = pva.PvObject(progress_structure(), 'scanlib:Progress:1.0')
+        self.progress['state'] = 'Idle'
+        self.server.addRecord(prefix + 'Plan', self.plan_table())
+        self.server.addRecord(prefix + 'Progress', self.progress)
+        self.server.addRecord(prefix + 'PlannedPositions', nd_array(self.planned, ','.join(POSITION_AXES)))
+        self.server.addRecord(prefix + 'ActualPositions', nd_array(self.actual, ','.join(POSITION_AXES)))
+
+    def plan_table(self):
+        """Returns the current plan as an NTTable with PLAN_COLUMNS"""
+
+        structure = plan_structure()
+        table = pva.PvObject({'labels': [pva.STRING], 'value': structure}, 'epics:nt/NTTable:1.0')
+        table['labels'] = list(structure)
+        if self.plan is not None:
+            steps = len(self.plan)
+            table['value.Key'] = np.asarray(self.plan.keys).astype(str).tolist()
+            for name in PLAN_COLUMNS:
+                if name in scanfile.STRING_PARAMS:
+                    values = self.plan[name] if name in self.plan else np.full(steps, '')
+                    table['value.' + name] = np.asarray(values).astype(str).tolist()
+                else:
+                    values = self.plan[name] if name in self.plan else np.full(steps, np.nan)
+                    table['value.' + name] = np.asarray(values).astype(float)
+            table['value.State'] = self.states.tolist()
+        return table
+
+    def publish_plan(self, plan, total=None):
+        """Publishes a new plan, all its steps pending.
+
+        Parameters
+        ----------
+        plan : ScanTable
+            Steps of the plan, None if they are not materialised, e.g. for
+            a Nested plan. Such a plan has an empty Plan table and no
+            positions arrays, its steps are only published on Progress.
+        total : int
+            Number of steps of a plan given as None
+        """
+
+        with self.lock:
+            self.plan = plan
+            steps = len(plan) if plan is not None else 0
+            self.indices = {str(key): index for index, key in enumerate(plan.keys)} if plan is not None else {}
+            self.states = np.full(steps, 'Pending', dtype=object)
+            self.planned = np.full((steps, len(POSITION_AXES)), np.nan)
+            for axis, key in enumerate(POSITION_AXES):
+                for name in preflight.MOTOR_COLUMNS[key]:
+                    if plan is not None and name in plan:
+                        self.planned[:, axis] = plan[name]
+                        break
+            self.actual = np.full_like(self.planned, np.nan)
+            self.total = steps if plan is not None else total
+            self.done = 0
+            self.step_starts = {}
+            self.next_index = 0
+            self.current = None
+            self.started = time.time()
+            self.progress['key'] = ''
+            self.progress['stepState'] = ''
+            self.progress['stepDuration'] = 0.0
+            self.progress['actualPositions'] = np.full(len(POSITION_AXES), np.nan)
+            self.server.update(self.prefix + 'PlannedPositions',
+                               nd_array(self.planned, ','.join(POSITION_AXES)))
+            self.publish_tables(force=True)
+            self.update_progress('Running')
+
+    def publish_tables(self, force=False):
+        """Republishes the Plan table and ActualPositions, called with the lock held.
+
+        Unless forced, nothing is published before PUBLISH_PERIOD, or
+        before the time of the last publication divided by PUBLISH_LOAD,
+        has passed since the last publication.
+        """
+
+        tic = time.monotonic()
+        if not force:
+            if not self.dirty or tic - self.published < max(PUBLISH_PERIOD, self.publish_cost / PUBLISH_LOAD):
+                return
+        self.server.update(self.prefix + 'Plan', self.plan_table())
+        self.server.update(self.prefix + 'ActualPositions', nd_array(self.actual, ','.join(POSITION_AXES)))
+        self.published = time.monotonic()
+        self.publish_cost = self.published - tic
+        self.dirty = False
+
+    def update_progress(self, state):
+        """Publishes the progress structure, called with the lock held"""
+
+        elapsed = time.time() - self.started if self.started is not None else 0.0
+        self.progress['index'] = self.current if self.current is not None else self.done
+        self.progress['total'] = self.total
+        self.progress['elapsed'] = elapsed
+        self.progress['eta'] = elapsed / self.done * (self.total - self.done) if self.done else 0.0
+        self.progress['state'] = state
+        self.server.update(self.prefix + 'Progress', self.progress)
+
+    def step_index(self, key, index=None):
+        """Returns the index of step key, index if the plan has no such key,
+        the next step if both are None"""
+
+        if key is None and index is None:
+            return self.next_index
+        return self.indices.get(str(key), index)
+
+    def step_key(self, key, index):
+        if key is not None:
+            return str(key)
+        return str(self.plan.keys[index]) if self.plan is not None else str(index)
+
+    def start_step(self, key=None, index=None):
+        """Marks a step as running, the next pending one if key and index are None"""
+
+        with self.lock:
+            index = self.step_index(key, index)
+            if index is None or index >= self.total:
+                return
+            self.current = index
+            self.next_index = index + 1
+            self.step_starts[index] = time.time()
+            if index < len(self.states):
+                self.states[index] = 'Running'
+                self.dirty = True
+            self.progress['key'] = self.step_key(key, index)
+            self.progress['stepState'] = 'Running'
+            self.update_progress('Running')
+            self.publish_tables()
+
+    def finish_step(self, key=None, actual=None, state='Done', index=None):
+        """Marks a step as done or failed and stores its actual positions.
+
+        Parameters
+        ----------
+        key : str
+            Step key, the current step if key and index are None
+        actual : dict
+            Position axis -> actual position
+        state : str
+            Final step state
+        index : int
+            Step index, used when the plan has no step key
+        """
+
+        with self.lock:
+            index = self.current if key is None and index is None else self.step_index(key, index)
+            if index is None or index >= self.total:
+                return
+            positions = np.full(len(POSITION_AXES), np.nan)
+            if actual is not None:
+                for axis, name in enumerate(POSITION_AXES):
+                    value = actual.get(name)
+                    positions[axis] = np.nan if value is None else value
+            if index < len(self.states):
+                self.states[index] = state
+                self.actual[index] = positions
+                self.dirty = True
+            duration = 0.0
+            if index in self.step_starts:
+                duration = time.time() - self.step_starts.pop(index)
+            self.done += 1
+            self.current = None
+            self.progress['key'] = self.step_key(key, index)
+            self.progress['stepState'] = state
+            self.progress['stepDuration'] = duration
+            self.progress['actualPositions'] = positions
+            self.update_progress('Running' if self.done < self.total else 'Done')
+            self.publish_tables()
+
+    def finish(self, state='Done'):
+        """Publishes the final state of the plan, e.g. Done or Aborted"""
+
+        with self.lock:
+            self.current = None
+            self.publish_tables(force=True)
+            self.update_progress(state)
+
+    def planned_positions(self):
+        """Returns the planned positions array, the server publishes copies of it"""
+
+        return self.planned
+
+    def actual_positions(self):
+        """Returns the actual positions array, the server publishes copies of it"""
+
+        return self.actual
+
+
+class NoPlanServer():
+    """Stand-in for PlanServer when the pvAccess server is disabled"""
+
+    def publish_plan(self, plan, total=None):
+        pass
+
+    def start_step(self, key=None, index=None):
+        pass
+
+    def finish_step(self, key=None, actual=None, state='Done', index=None):
+        pass
+
+    def finish(self, state='Done'):
+        pass
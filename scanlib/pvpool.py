@@ -0,0 +1,168 @@
+'''
+    Process-wide pool of EPICS PV channels
+
+    Channels are keyed by their expanded PV name, created on first use and
+    shared by every ScanLib instance and scan type in the process. Channels
+    that are not pinned are disconnected after being idle for a while.
+
+    The PV class is provided by a backend, imported the first time a channel
+    is created:
+
+    - ca : epics.PV from pyepics
+    - sim : simpv.SimPV, simulated in-process PVs
+'''
+import time
+import threading
+import importlib
+
+from scanlib import log
+from scanlib import trace
+
+# Seconds an unpinned channel can stay unused before it is evicted
+IDLE_TIMEOUT = 600
+
+# Backend name -> (module, PV class)
+BACKENDS = {
+    'ca': ('epics', 'PV'),
+    'sim': ('scanlib.simpv', 'SimPV'),
+}
+
+
+class PoolPV():
+    """Channel of the pool, wrapping a backend PV.
+
+    Reports its connections, puts and gets to the pool that created it and,
+    when tracing is enabled, records them in the trace recorder. All other
+    attributes are those of the backend PV.
+    """
+
+    def __init__(self, pvname, pool, pv_class):
+
+        self.pool = pool
+        self.last_used = time.time()
+        self.pv = pv_class(pvname, connection_callback=self.connection_callback)
+
+    def __getattr__(self, name):
+        return getattr(self.pv, name)
+
+    def __repr__(self):
+        return 'PoolPV(%s)' % self.pv.pvname
+
+    def connection_callback(self, pvname=None, conn=None, **kw):
+        self.pool.count('connects' if conn else 'disconnects')
+
+    @property
+    def value(self):
+        return self.get()
+
+    def get(self, *args, **kwargs):
+        self.last_used = time.time()
+        self.pool.count('gets')
+        if not trace.recorder.enabled:
+            return self.pv.get(*args, **kwargs)
+        value = self.pv.get(*args, **kwargs)
+        trace.recorder.record('get', self.pv.pvname, value, self.last_used, time.time())
+        return value
+
+    def put(self, value, *args, **kwargs):
+        self.last_used = time.time()
+        self.pool.count('puts')
+        if not trace.recorder.enabled:
+            return self.pv.put(value, *args, **kwargs)
+        status = self.pv.put(value, *args, **kwargs)
+        op = 'put_wait' if kwargs.get('wait', args[0] if args else False) else 'put'
+        trace.recorder.record(op, self.pv.pvname, value, self.last_used, time.time())
+        return status
+
+
+class PVPool():
+    """Registry of PoolPV channels keyed by expanded PV name.
+
+        Parameters
+        ----------
+        backend : str
+            Name of the PV backend, see BACKENDS
+    """
+
+    def __init__(self, backend='ca'):
+
+        self.lock = threading.RLock()
+        self.pvs = {}
+        self.pinned = set()
+        self.backend = backend
+        self.pv_class = None
+        self.counters = {'created': 0, 'connects': 0, 'disconnects': 0,
+                         'puts': 0, 'gets': 0, 'evicted': 0}
+
+    def set_backend(self, backend):
+        """Selects the PV backend, before the first channel is created"""
+
+        if backend not in BACKENDS:
+            raise ValueError('unknown PV backend %s, use one of %s' % (backend, list(BACKENDS)))
+        with self.lock:
+            if self.pvs and backend != self.backend:
+                raise RuntimeError('PV backend cannot change once channels exist')
+            self.backend = backend
+            self.pv_class = None
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get_pv(self, pvname, pin=False):
+        """Returns the channel for pvname, creating it on first use.
+
+        Parameters
+        ----------
+        pvname : str
+            Expanded PV name
+        pin : bool
+            If True the channel is never evicted
+        """
+
+        with self.lock:
+            epics_pv = self.pvs.get(pvname)
+            if epics_pv is None:
+                if self.pv_class is None:
+                    module_name, class_name = BACKENDS[self.backend]
+                    self.pv_class = getattr(importlib.import_module(module_name), class_name)
+                epics_pv = PoolPV(pvname, self, self.pv_class)
+                self.pvs[pvname] = epics_pv
+                self.counters['created'] += 1
+            if pin:
+                self.pinned.add(pvname)
+        epics_pv.last_used = time.time()
+        return epics_pv
+
+    def evict_idle(self, max_idle=IDLE_TIMEOUT):
+        """Disconnects unpinned channels not used in the last max_idle seconds"""
+
+        now = time.time()
+        with self.lock:
+            idle = [pvname for pvname, epics_pv in self.pvs.items()
+                    if pvname not in self.pinned and now - epics_pv.last_used > max_idle]
+            evicted = [self.pvs.pop(pvname) for pvname in idle]
+            self.counters['evicted'] += len(evicted)
+        for epics_pv in evicted:
+            log.debug('evicting idle PV %s', epics_pv.pvname)
+            epics_pv.disconnect()
+
+    def stats(self):
+        """Returns the number of channels and the connect/put/get counters"""
+
+        with self.lock:
+            stats = dict(self.counters)
+            stats['channels'] = len(self.pvs)
+            stats['pinned'] = len(self.pinned)
+            stats['connected'] = sum(epics_pv.connected for epics_pv in self.pvs.values())
+            stats['backend'] = self.backend
+        return stats
+
+
+pool = PVPool()
+
+
+def get_pv(pvname, pin=False):
+    """Returns the shared channel for pvname from the process-wide pool"""
+
+    return pool.get_pv(pvname, pin)
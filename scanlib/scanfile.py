@@ -0,0 +1,287 @@
+'''
+    Scan file support
+
+    A scan file lists the tomoscan parameters to use for each entry of a
+    ``Scan File`` scan. Two formats are supported:
+
+    - JSON : a dictionary of dictionaries, one per entry, each listing all
+      the parameters in SCAN_PARAMS.
+
+    - NPZ : a columnar scan table. Parameters that change between entries
+      are stored as one column each, parameters that are the same for all
+      entries are stored once as a default. Columns are memory-mapped when
+      the file is opened so very long scans load instantly.
+'''
+import os
+import json
+import zipfile
+import argparse
+
+from scanlib import log
+from scanlib import util
+
+np = util.lazy_import('numpy')
+
+# Parameters of a scan file entry and the tomoscan PV they are written to
+SCAN_PARAMS = (
+    'SampleX',
+    'SampleY',
+    'RotationStart',
+    'RotationStep',
+    'NumAngles',
+    'ReturnRotation',
+    'NumDarkFields',
+    'DarkFieldMode',
+    'DarkFieldValue',
+    'NumFlatFields',
+    'FlatFieldAxis',
+    'FlatFieldMode',
+    'FlatFieldValue',
+    'FlatExposureTime',
+    'DifferentFlatExposure',
+    'SampleInX',
+    'SampleOutX',
+    'SampleInY',
+    'SampleOutY',
+    'SampleOutAngleEnable',
+    'SampleOutAngle',
+    'ScanType',
+    'FlipStitch',
+    'ExposureTime',
+)
+
+# Parameters holding tomoscan enum strings
+STRING_PARAMS = (
+    'ReturnRotation',
+    'DarkFieldMode',
+    'FlatFieldAxis',
+    'FlatFieldMode',
+    'DifferentFlatExposure',
+    'SampleOutAngleEnable',
+    'ScanType',
+    'FlipStitch',
+)
+
+# Allowed (min, max) range of numeric parameters, None means unbounded
+PARAM_RANGES = {
+    'NumAngles':        (1, None),
+    'NumDarkFields':    (0, None),
+    'NumFlatFields':    (0, None),
+    'FlatExposureTime': (0, None),
+    'ExposureTime':     (0, None),
+}
+
+# Name of the npz member holding the entry keys
+KEYS_NAME = '__keys__'
+
+
+class ScanTable():
+    """Columnar table of scan file entries.
+
+        Parameters
+        ----------
+        keys : array
+            Entry names, one per entry.
+        columns : dict
+            Parameter name -> array with one value per entry.
+        defaults : dict
+            Parameter name -> value shared by all entries.
+    """
+
+    def __init__(self, keys, columns, defaults=None):
+
+        self.keys = keys
+        self.columns = columns
+        self.defaults = defaults if defaults is not None else {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return name in self.columns or name in self.defaults
+
+    @property
+    def names(self):
+        """Parameter names present in the table, in SCAN_PARAMS order first"""
+
+        names = [name for name in SCAN_PARAMS if name in self]
+        names += [name for name in list(self.columns) + list(self.defaults) if name not in names]
+        return names
+
+    def __getitem__(self, name):
+        """Returns one value per entry for parameter name.
+
+        Default columns are broadcast without allocating a full array.
+        """
+
+        if name in self.columns:
+            return self.columns[name]
+        return np.broadcast_to(np.asarray(self.defaults[name]), (len(self),))
+
+    def entry(self, index):
+        """Returns entry index as a dictionary of python scalars"""
+
+        return {name: self[name][index].item() for name in self.names}
+
+    def items(self):
+        """Iterates over (key, entry) pairs, same as a JSON scan dictionary"""
+
+        for index in range(len(self)):
+            yield str(self.keys[index]), self.entry(index)
+
+    def validate(self):
+        """Checks the whole table at once.
+
+        Returns
+        -------
+        list
+            One message per problem found, empty if the table is valid.
+        """
+
+        errors = []
+        missing = [name for name in SCAN_PARAMS if name not in self]
+        if missing:
+            errors.append('missing parameters: %s' % ', '.join(missing))
+        for name in self.names:
+            values = np.asarray(self[name])
+            if name in STRING_PARAMS:
+                if values.dtype.kind not in 'US':
+                    errors.append('%s must be a string' % name)
+                continue
+            if values.dtype.kind not in 'biuf':
+                errors.append('%s must be numeric' % name)
+                continue
+            bad = ~np.isfinite(values)
+            low, high = PARAM_RANGES.get(name, (None, None))
+            if low is not None:
+                bad |= values < low
+            if high is not None:
+                bad |= values > high
+            for index in np.flatnonzero(bad):
+                errors.append('%s: %s = %s out of range' % (self.keys[index], name, values[index]))
+        return errors
+
+    def save(self, fname):
+        """Saves the table as an uncompressed npz so it can be memory-mapped"""
+
+        arrays = {KEYS_NAME: np.asarray(self.keys, dtype=str)}
+        arrays.update({name: np.asarray(values) for name, values in self.columns.items()})
+        arrays.update({name: np.asarray(value) for name, value in self.defaults.items()})
+        with open(fname, 'wb') as npz_file:
+            np.savez(npz_file, **arrays)
+
+    def save_json(self, fname):
+        """Saves the table as a JSON dictionary of dictionaries"""
+
+        with open(fname, 'w') as json_file:
+            json.dump(dict(self.items()), json_file, indent=4)
+
+    @classmethod
+    def from_dict(cls, scan_dict):
+        """Builds a table from a JSON style dictionary of dictionaries.
+
+        Parameters that have the same value in every entry are stored once
+        as defaults.
+        """
+
+        keys = np.asarray(list(scan_dict), dtype=str)
+        entries = list(scan_dict.values())
+        names = []
+        for entry in entries:
+            names += [name for name in entry if name not in names]
+        columns = {}
+        defaults = {}
+        for name in names:
+            values = np.asarray([entry.get(name) for entry in entries])
+            if values.dtype.kind == 'O':
+                raise ValueError('parameter %s is missing or has mixed types' % name)
+            if len(values) > 0 and np.all(values == values[0]):
+                defaults[name] = values[0]
+            else:
+                columns[name] = values
+        return cls(keys, columns, defaults)
+
+
+def _load_npz(fname):
+    """Opens an npz file, memory-mapping every uncompressed member"""
+
+    arrays = {}
+    with zipfile.ZipFile(fname) as zip_file:
+        infos = zip_file.infolist()
+    with open(fname, 'rb') as npz_file:
+        for info in infos:
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with np.load(fname) as npz:
+                    arrays[name] = npz[name]
+                continue
+            # Skip the zip local file header to reach the npy data
+            npz_file.seek(info.header_offset + 26)
+            name_length = int.from_bytes(npz_file.read(2), 'little')
+            extra_length = int.from_bytes(npz_file.read(2), 'little')
+            npz_file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(npz_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+            if dtype.hasobject:
+                raise ValueError('%s: object arrays are not supported' % name)
+            if shape == ():
+                arrays[name] = np.frombuffer(npz_file.read(dtype.itemsize), dtype)[0]
+            else:
+                arrays[name] = np.memmap(fname, dtype=dtype, mode='r', offset=npz_file.tell(),
+                                         shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load(fname):
+    """Reads a scan file.
+
+    Parameters
+    ----------
+    fname : str
+        JSON or npz scan file name
+
+    Returns
+    -------
+    ScanTable
+    """
+
+    if os.path.splitext(fname)[1].lower() == '.npz':
+        arrays = _load_npz(fname)
+        keys = arrays.pop(KEYS_NAME)
+        columns = {name: value for name, value in arrays.items() if np.ndim(value) == 1}
+        defaults = {name: value for name, value in arrays.items() if np.ndim(value) == 0}
+        if any(len(values) != len(keys) for values in columns.values()):
+            raise ValueError('columns of %s have different lengths' % fname)
+        return ScanTable(keys, columns, defaults)
+    with open(fname) as json_file:
+        scan_dict = json.load(json_file)
+    return ScanTable.from_dict(scan_dict)
+
+
+def convert(src, dst):
+    """Converts a scan file between the JSON and npz formats.
+
+    The format of each file is selected by its extension.
+    """
+
+    table = load(src)
+    if os.path.splitext(dst)[1].lower() == '.npz':
+        table.save(dst)
+    else:
+        table.save_json(dst)
+    log.info('converted %s (%d entries) to %s', src, len(table), dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert scanlib scan files between JSON and npz')
+    parser.add_argument('src', help='input scan file (.json or .npz)')
+    parser.add_argument('dst', help='output scan file (.json or .npz)')
+    args = parser.parse_args()
+    convert(args.src, args.dst)
+
+
+if __name__ == '__main__':
+    main()
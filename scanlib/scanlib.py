@@ -1,17 +1,41 @@
 import os
-import pvaccess as pva
-import numpy as np
-import queue
 import time
 import threading
 import signal
-import json
 import sys
 
-from pathlib import Path
 from scanlib import util
 from scanlib import log
-from epics import PV
+from scanlib import scanfile
+from scanlib import pvpool
+from scanlib import trace
+from scanlib import nested
+from scanlib import station
+from scanlib import preflight
+from scanlib import pvaserver
+from scanlib import motion
+from scanlib import putengine
+from scanlib import scheduler
+from scanlib import plans
+
+np = util.lazy_import('numpy')
+
+
+# PVs that must be connected before the callbacks and the watchdog start
+CORE_PVS = ('StartScan', 'AbortScan', 'Watchdog', 'ScanLibStatus')
+
+# Seconds to wait for PVs to connect at startup
+CONNECTION_TIMEOUT = 1
+
+# Seconds between watchdog resets and between evictions of idle PV channels
+WATCHDOG_PERIOD = 3
+EVICT_PERIOD = 60
+
+# Seconds between attempts to connect to the tomoscan servers
+CONNECT_RETRY_PERIOD = 10
+
+# Startup phases timed in startup_times, in order
+STARTUP_PHASES = ('read_pv_files', 'core_pvs', 'ready')
 
 
 class ScanLib():
@@ -19,98 +43,186 @@ class ScanLib():
 
         Parameters
         ----------
-        args : dict
-            Dictionary of pv variables.
+        pv_files : list
+            Files listing the ScanLib PVs, see read_pv_file()
+        macros : dict
+            Macro substitutions applied to the PV names
+        pva_server : bool
+            If True the plan and progress are served over pvAccess
     """
 
-    def __init__(self, pv_files, macros):
+    def __init__(self, pv_files, macros, pva_server=True):
+
+        tic = time.time()
+        self.startup_times = {}
+        self.ready = threading.Event()
 
         # init pvs
         self.scan_is_running = False
         self.config_pvs = {}
         self.control_pvs = {}
         self.pv_prefixes = {}
-        
+        self.fsname = None
+        self.scan_table = None
+        self.stations = []
+        self.plan_servers = {}
+        self.plans = plans.PlanQueue(self.execute)
+
         if not isinstance(pv_files, list):
             pv_files = [pv_files]
         for pv_file in pv_files:
             self.read_pv_file(pv_file, macros)
+        self.startup_times['read_pv_files'] = time.time() - tic
 
         if 'Tomoscan' not in self.pv_prefixes:
             log.error('TomoscanPVPrefix must be present in autoSettingsFile')
             sys.exit()
 
-        self.show_pvs()
-
-        # Define PVs from the tomoScan IOC that we will need
-        tomoscan_prefix = self.pv_prefixes['Tomoscan']
-
-        # is better to remove this to avoid a dependency on having the tomoscan IOC up.
-        # Best is to pass the sampleX/Y PVs as scanLib epics PV names.
-        
-        sample_x_pv_name                            = PV(tomoscan_prefix + 'SampleXPVName').value
-        sample_y_pv_name                            = PV(tomoscan_prefix + 'SampleYPVName').value
-        self.control_pvs['TSSampleX']               = PV(sample_x_pv_name)
-        self.control_pvs['TSSampleY']               = PV(sample_y_pv_name)
-        self.control_pvs['TSStartScan']             = PV(tomoscan_prefix + 'StartScan')
-        self.control_pvs['TSAbortScan']             = PV(tomoscan_prefix + 'AbortScan')
-        self.control_pvs['TSServerRunning']         = PV(tomoscan_prefix + 'ServerRunning')
-        self.control_pvs['TSScanStatus']            = PV(tomoscan_prefix + 'ScanStatus')
-        self.control_pvs['TSSampleName']            = PV(tomoscan_prefix + 'SampleName')
-        self.control_pvs['TSRotationStart']         = PV(tomoscan_prefix + 'RotationStart')  
-        self.control_pvs['TSRotationStep']          = PV(tomoscan_prefix + 'RotationStep')  
-        self.control_pvs['TSNumAngles']             = PV(tomoscan_prefix + 'NumAngles')  
-        self.control_pvs['TSReturnRotation']        = PV(tomoscan_prefix + 'ReturnRotation')  
-        self.control_pvs['TSNumDarkFields']         = PV(tomoscan_prefix + 'NumDarkFields')  
-        self.control_pvs['TSDarkFieldMode']         = PV(tomoscan_prefix + 'DarkFieldMode')  
-        self.control_pvs['TSDarkFieldValue']        = PV(tomoscan_prefix + 'DarkFieldValue')  
-        self.control_pvs['TSNumFlatFields']         = PV(tomoscan_prefix + 'NumFlatFields')
-        self.control_pvs['TSFlatFieldAxis']         = PV(tomoscan_prefix + 'FlatFieldAxis')
-        self.control_pvs['TSFlatFieldMode']         = PV(tomoscan_prefix + 'FlatFieldMode')
-        self.control_pvs['TSFlatFieldValue']        = PV(tomoscan_prefix + 'FlatFieldValue')  
-        self.control_pvs['TSFlatExposureTime']      = PV(tomoscan_prefix + 'FlatExposureTime')  
-        self.control_pvs['TSDifferentFlatExposure'] = PV(tomoscan_prefix + 'DifferentFlatExposure')
-        self.control_pvs['TSSampleInX']             = PV(tomoscan_prefix + 'SampleInX')
-        self.control_pvs['TSSampleOutX']            = PV(tomoscan_prefix + 'SampleOutX')  
-        self.control_pvs['TSSampleInY']             = PV(tomoscan_prefix + 'SampleInY')
-        self.control_pvs['TSSampleOutY']            = PV(tomoscan_prefix + 'SampleOutY')  
-        self.control_pvs['TSSampleOutAngleEnable']  = PV(tomoscan_prefix + 'SampleOutAngleEnable') 
-        self.control_pvs['TSSampleOutAngle']        = PV(tomoscan_prefix + 'SampleOutAngle')  
-        self.control_pvs['TSScanType']              = PV(tomoscan_prefix + 'ScanType')
-        self.control_pvs['TSFlipStitch']            = PV(tomoscan_prefix + 'FlipStitch')
-        self.control_pvs['TSExposureTime']          = PV(tomoscan_prefix + 'ExposureTime')
-
         self.epics_pvs = {**self.config_pvs, **self.control_pvs}
-        # Wait 1 second for all PVs to connect
-        time.sleep(1)
-        self.check_pvs_connected()
+
+        # Start callbacks and watchdog as soon as the PVs they use are connected
+        for epics_pv in CORE_PVS:
+            if not self.epics_pvs[epics_pv].wait_for_connection(timeout=CONNECTION_TIMEOUT):
+                log.error('PV %s is not connected', self.epics_pvs[epics_pv].pvname)
 
         # Set some initial PV values
         for epics_pv in ('StartScan', 'AbortScan'):
             self.epics_pvs[epics_pv].put(0)
 
         # Configure callbacks on a few PVs
+        self.callback_indices = {}
         for epics_pv in ('StartScan', 'AbortScan', 'SleepSelect', 'ScanFileName', "EnergyFileName"):
-            self.epics_pvs[epics_pv].add_callback(self.pv_callback)
+            self.callback_indices[epics_pv] = self.epics_pvs[epics_pv].add_callback(self.pv_callback)
+
+        # Reset the watchdog from the timer thread shared by all the instances of the process
+        self.watchdog_task = scheduler.scheduler.every(WATCHDOG_PERIOD, self.reset_watchdog,
+                                                       name=self.epics_pvs['Watchdog'].pvname)
+        scheduler.scheduler.every(EVICT_PERIOD, pvpool.pool.evict_idle, name='pvpool.evict_idle')
+        scheduler.scheduler.every(motion.SAVE_INTERVAL, motion.model.save, name='motion.model.save')
+        self.startup_times['core_pvs'] = time.time() - tic
 
-        # Start the watchdog timer thread
-        thread = threading.Thread(target=self.reset_watchdog, args=(), daemon=True)
-        thread.start()
+        # Connect to the tomoscan servers in the background until it succeeds, scans wait for self.ready
+        self.connect_future = None
+        self.connect_task = scheduler.scheduler.every(
+            CONNECT_RETRY_PERIOD, lambda: self.retry_connect(pva_server, tic),
+            name=self.epics_pvs['StartScan'].pvname + ':connect')
 
         # log.setup_custom_logger("./scanlib.log")
 
         # self.epics_pvs['ScanLibStatus'].put('All good!')
 
+    def retry_connect(self, pva_server, tic):
+        """Starts an attempt to connect to the tomoscan servers unless connected or already trying"""
+
+        if self.ready.is_set():
+            self.connect_task.cancel()
+            return
+        if self.connect_future is None or self.connect_future.done():
+            self.connect_future = scheduler.scheduler.submit(self.connect_stations, pva_server, tic)
+
+    def connect_stations(self, pva_server, tic):
+        """Connects to the tomoscan servers and starts the pvAccess server, then sets self.ready.
+
+        A connection failure is reported in ScanLibStatus, retry_connect()
+        tries again later. The pvAccess server is started once connected,
+        see start_plan_servers().
+
+        Returns
+        -------
+        bool
+            True if connected
+        """
+
+        try:
+            # Define PVs from the tomoScan IOC that we will need
+            tomoscan_prefix = self.pv_prefixes['Tomoscan']
+
+            # is better to remove this to avoid a dependency on having the tomoscan IOC up.
+            # Best is to pass the sampleX/Y PVs as scanLib epics PV names.
+            control_pvs = station.tomoscan_pvs(tomoscan_prefix)
+
+            # Additional tomoscan servers (Tomoscan2PVPrefix, ...) share the scan file entries
+            keys = [key for key in sorted(self.pv_prefixes)
+                    if key.startswith('Tomoscan') and self.pv_prefixes[key] != '']
+            stations = [station.Station(self.pv_prefixes[key]) for key in keys]
+
+            # Wait up to 1 second for all PVs to connect
+            self.control_pvs.update(control_pvs)
+            self.epics_pvs.update(control_pvs)
+            deadline = time.time() + CONNECTION_TIMEOUT
+            for epics_pv in self.epics_pvs.values():
+                epics_pv.wait_for_connection(timeout=max(deadline - time.time(), 0.001))
+            self.check_pvs_connected()
+            missing = [epics_pv.pvname for scan_station in stations
+                       for epics_pv in scan_station.epics_pvs.values() if not epics_pv.connected]
+            if missing:
+                raise RuntimeError('%d tomoscan PVs not connected, e.g. %s' % (len(missing), missing[0]))
+        except Exception as e:
+            message = 'Cannot connect to tomoscan, retrying in %d s: %s' % (CONNECT_RETRY_PERIOD, e)
+            log.error(message)
+            self.epics_pvs['ScanLibStatus'].put(message[:255])
+            return False
+
+        self.stations = stations
+        log.info('tomoscan stations: %s', self.stations)
+        status = 'Connected to tomoscan'
+        if pva_server and not self.start_plan_servers(keys):
+            status += ', pvAccess server not started, see the log'
+        self.startup_times['ready'] = time.time() - tic
+        self.show_pvs()
+        self.epics_pvs['ScanLibStatus'].put(status)
+        self.ready.set()
+        return True
+
+    def start_plan_servers(self, keys):
+        """Serves the plan and progress of each station over pvAccess.
+
+        The first station uses the ScanLib PV prefix (2bmb:ScanLib:Plan),
+        the others their key (2bmb:ScanLib:Tomoscan2:Plan), so plans
+        running at the same time on different stations do not overwrite
+        each other. If the server cannot start, e.g. pvaccess is not
+        installed, the error is logged and the plans of the stations left
+        without channels run without them.
+
+        Parameters
+        ----------
+        keys : list
+            PV prefix keys of self.stations, e.g. Tomoscan, Tomoscan2
+
+        Returns
+        -------
+        bool
+            True if every station has its channels
+        """
+
+        scanlib_prefix = self.epics_pvs['StartScan'].pvname[:-len('StartScan')]
+        for index, (key, scan_station) in enumerate(zip(keys, self.stations)):
+            prefix = scanlib_prefix if index == 0 else scanlib_prefix + key + ':'
+            try:
+                self.plan_servers[scan_station.tomoscan_prefix] = pvaserver.PlanServer(prefix)
+            except Exception as e:
+                log.error('pvAccess server not started for %s: %s: %s', prefix, type(e).__name__, e)
+                return False
+        return True
+
     def signal_handler(self, sig, frame):
         """Calls abort_scan when ^C is typed"""
         if sig == signal.SIGINT:
             self.abort_scan()
 
     def reset_watchdog(self):
-        """Sets the watchdog timer to 5 every 3 seconds"""
-        while True:
-            self.epics_pvs['Watchdog'].put(5)
-            time.sleep(3)
+        """Sets the watchdog timer to 5, called every WATCHDOG_PERIOD seconds by the scheduler"""
+
+        self.epics_pvs['Watchdog'].put(5)
+
+    def close(self):
+        """Stops the watchdog and the PV callbacks of this instance and saves the motion model"""
+
+        self.watchdog_task.cancel()
+        self.connect_task.cancel()
+        motion.model.save()
+        for epics_pv in ('StartScan', 'AbortScan', 'SleepSelect', 'ScanFileName', "EnergyFileName"):
+            self.epics_pvs[epics_pv].remove_callback(self.callback_indices[epics_pv])
 
     def read_pv_file(self, pv_file_name, macros):
         """Reads a file containing a list of EPICS PVs to be used by ScanLib.
@@ -149,7 +261,7 @@ class ScanLib():
             for key in macros:
                 dictentry = dictentry.replace(key, '')
 
-            epics_pv = PV(pvname)
+            epics_pv = pvpool.get_pv(pvname, pin=True)
 
             if is_config_pv:
                 self.config_pvs[dictentry] = epics_pv
@@ -162,7 +274,7 @@ class ScanLib():
             if dictentry.find('PVName') != -1:
                 pvname = epics_pv.value
                 key = dictentry.replace('PVName', '')
-                self.control_pvs[key] = PV(pvname)
+                self.control_pvs[key] = pvpool.get_pv(pvname, pin=True)
             if dictentry.find('PVPrefix') != -1:
                 pvprefix = epics_pv.value
                 key = dictentry.replace('PVPrefix', '')
@@ -181,6 +293,9 @@ class ScanLib():
 
         - pv_prefixes : The prefixes for PVs that are used for the areaDetector camera,
           file plugin, etc.
+
+        - pv_pool : The number of channels and the connect/put/get counters
+          of the process-wide PV pool
         """
 
         print('configPVS:')
@@ -197,6 +312,11 @@ class ScanLib():
         for pv_prefix in self.pv_prefixes:
             print(pv_prefix, ':', self.pv_prefixes[pv_prefix])
 
+        print('')
+        print('pv_pool:')
+        for key, value in pvpool.pool.stats().items():
+            print(key, ':', value)
+
     def check_pvs_connected(self):
         """Checks whether all EPICS PVs are connected.
 
@@ -225,11 +345,9 @@ class ScanLib():
 
         log.debug('pv_callback pvName=%s, value=%s, char_value=%s', pvname, value, char_value)
         if pvname.find('ScanFileName') != -1:
-            thread = threading.Thread(target=self.set_scan_file_name, args=())
-            thread.start()
+            scheduler.scheduler.submit(self.set_scan_file_name)
         elif pvname.find('EnergyFileName') != -1:
-            thread = threading.Thread(target=self.set_energy_file_name, args=())
-            thread.start()
+            scheduler.scheduler.submit(self.set_energy_file_name)
         elif (pvname.find('StartScan') != -1) and (value == 1):
             self.run_scans()
         elif (pvname.find('AbortScan') != -1) and (value == 1):
@@ -239,22 +357,26 @@ class ScanLib():
         """Check the scan file exists and is correctly formatted"""
 
         self.fsname = self.epics_pvs['ScanFileName'].value
-        print(self.fsname, os.path.isfile(self.fsname))
+        self.scan_table = None
         if (os.path.isfile(self.fsname)):
-            self.epics_pvs['ScanFileOK'].put(1)
             self.epics_pvs['ScanLibStatus'].put(self.fsname + ' exists')
             try:
-                with open(self.fsname) as json_file:
-                    scan_dict = json.load(json_file)
-                self.epics_pvs['ScanLibStatus'].put('JSON File formatting OK')
-            except FileNotFoundError:
-                log.error('File %s not found', self.fsname)
+                scan_table = scanfile.load(self.fsname)
+            except Exception as e:
+                log.error('File %s is not correcly formatted: %s', self.fsname, e)
+                self.epics_pvs['ScanLibStatus'].put('Scan file formatting error')
                 self.epics_pvs['ScanFileOK'].put(0)
-                self.epics_pvs['ScanLibStatus'].put('File error')
-            except:
-                log.error('File %s is not correcly formatted', self.fsname)
-                self.epics_pvs['ScanLibStatus'].put('JSON File formatting error')
+                return
+            errors = scan_table.validate()
+            if errors:
+                for error in errors:
+                    log.error('File %s: %s', self.fsname, error)
+                self.epics_pvs['ScanLibStatus'].put('Scan file error: ' + errors[0])
                 self.epics_pvs['ScanFileOK'].put(0)
+                return
+            self.scan_table = scan_table
+            self.epics_pvs['ScanFileOK'].put(1)
+            self.epics_pvs['ScanLibStatus'].put('Scan file OK: %d entries' % len(scan_table))
         else:
             self.epics_pvs['ScanLibStatus'].put('Scan file does not exist')
             self.epics_pvs['ScanFileOK'].put(0)
@@ -282,147 +404,644 @@ class ScanLib():
           If ``wait_camera_done()`` finds the flag set then it raises a 
           ScanAbortError exception.
 
+        - Cancels the pending and running plans.
+
         - Stops the rotation motor.
 
         - Stops the file saving plugin.
         """
 
         self.scan_is_running = False
+        self.plans.cancel_all()
+
+        # Abort the current scan on every station
+        self.abort_stations(self.stations)
+
+    def abort_stations(self, stations):
+        """Aborts the current scan of each station, tomoscan aborts when AbortScan is set to 1"""
 
-        # Abort the current scan
-        self.control_pvs['TSAbortScan'].put(0)
+        for scan_station in stations:
+            scan_station.epics_pvs['TSAbortScan'].put(1)
 
     def run_scans(self):
-        """Runs ``fly_scan()`` in a new thread."""
+        """Runs ``run_scan()`` on the shared worker threads."""
 
-        thread = threading.Thread(target=self.run_scan, args=())
-        thread.start()
+        scheduler.scheduler.submit(self.run_scan)
 
     def run_scan(self):
-        
-        tomoscan_prefix = self.pv_prefixes['Tomoscan']
+        """Submits the scan set in the ScanLib PVs.
+
+        The PV interface is a client of the python API: the plan is built
+        from the PVs by plan_from_pvs() and queued with submit().
+
+        Returns
+        -------
+        ScanFuture
+            None if the tomoscan servers are not connected.
+        """
+
+        if not self.ready.wait(timeout=60):
+            log.error('Not connected to the tomoscan servers, scan not started')
+            return None
+        future = self.submit(self.plan_from_pvs())
+        future.add_done_callback(self.report_result)
+        return future
+
+    def report_result(self, future):
+        """Writes the outcome of a plan submitted through the PVs to ScanLibStatus.
+
+        Plans that could not start are only logged, so the preflight
+        violations stay in ScanLibStatus.
+        """
+
+        if future.cancelled():
+            self.epics_pvs['ScanLibStatus'].put('%s scan cancelled' % future.plan.kind)
+        elif future.exception() is None:
+            result = future.result()
+            self.epics_pvs['ScanLibStatus'].put('%s scan %s: %d steps' % (future.plan.kind, result['state'],
+                                                                          result['steps']))
+
+    def plan_from_pvs(self):
+        """Returns the plan set in the ScanType, sleep, in-situ and testing PVs"""
+
+        scan_type = self.epics_pvs['ScanType'].get(as_string=True)
         sleep_steps = self.epics_pvs['SleepSteps'].get()
-        sleep_time  = self.epics_pvs['SleepTime'].get()
-        sleep_select  = self.epics_pvs['SleepSelect'].get(as_string=True)
+        sleep_time = self.epics_pvs['SleepTime'].get()
+        sleep_select = self.epics_pvs['SleepSelect'].get(as_string=True)
         in_situ_select = self.epics_pvs['InsituSelect'].get(as_string=True)
         in_situ_start = self.epics_pvs['InsituStart'].get()
         in_situ_step_size = self.epics_pvs['InsituStepSize'].get()
-        
-        scan_type = self.epics_pvs['ScanType'].get(as_string=True) 
-        self.epics_pvs['TSScanType'].put(scan_type)
-        if self.epics_pvs['TSServerRunning'].get():
-            if self.epics_pvs['TSScanStatus'].get(as_string=True) == 'Scan complete':
-                log.warning('%s scan start', scan_type)
-                self.epics_pvs['TSScanType'].put(scan_type, wait=True)
-                if (sleep_steps >= 1) and (sleep_select == 'Yes'):
-                    log.warning('running %d x %2.2fs sleep scans', sleep_steps, sleep_time)
-                    tic =  time.time()
-                    for ii in np.arange(0, sleep_steps, 1):
-                        log.warning('sleep start scan %d/%d', ii, sleep_steps-1)
-                        self.scan()
-                        if (sleep_steps+1)!=(ii+1):
-                            if (in_situ_select == 'Yes'):
-                                in_situ_set_value = in_situ_start + (ii) * in_situ_step_size
-                                log.error('in-situ set value: %3.3f ', in_situ_set_value)
-                                # set in-situ PV
-                                # wait on in-situ read back value
-                            log.warning('wait (s): %s ' , str(sleep_time))
-                            time.sleep(sleep_time)
-                    dtime = (time.time() - tic)/60.
-                    log.info('sleep scans time: %3.3f minutes', dtime)
-                    log.warning('sleep scan end')
-                else:
-                    self.scan()
-                log.warning('%s scan end', scan_type)
-                self.epics_pvs['TSScanType'].put('Single', wait=True)
-            else:
-                log.error('Server %s is busy. Please run a scan manually first.', tomoscan_prefix)
+        testing_select = self.epics_pvs['TestingSelect'].get(as_string=True)
+
+        repeats = int(sleep_steps) if (sleep_steps >= 1) and (sleep_select == 'Yes') else 1
+        insitu = (in_situ_start, in_situ_step_size) if in_situ_select == 'Yes' else None
+        # The entries of a scan file are shared by all the stations
+        stations = self.stations if scan_type == 'Scan File' else self.stations[:1]
+        return plans.Plan(scan_type, self.compile_plan(), stations, repeats, sleep_time,
+                          testing=(testing_select == 'Yes'), insitu=insitu)
+
+    def submit(self, plan):
+        """Queues a plan and returns at once.
+
+        Plans run in submission order, at the same time when they use
+        different stations.
+
+        Parameters
+        ----------
+        plan : Plan
+            e.g. from plan_from_pvs(), or built by single(), vertical(),
+            horizontal(), mosaic(), scan_file(), energy() or sleep_series()
+
+        Returns
+        -------
+        ScanFuture
+            Streams the progress events, can be cancelled and awaited.
+        """
+
+        return self.plans.submit(plan)
+
+    def get_stations(self, stations, default):
+        """Returns the Station objects of a list of stations or tomoscan prefixes, default if None"""
+
+        if stations is None:
+            return default
+        by_prefix = {scan_station.tomoscan_prefix: scan_station for scan_station in self.stations}
+        return [by_prefix[scan_station] if isinstance(scan_station, str) else scan_station
+                for scan_station in stations]
+
+    def stage_plan(self, scan_type, y_positions=None, x_positions=None, stations=None,
+                   repeats=1, sleep_time=0, testing=False):
+        """Submits a Single, Vertical, Horizontal or Mosaic plan, see stage_table()"""
+
+        if not self.ready.wait(timeout=60):
+            raise RuntimeError('Not connected to the tomoscan servers')
+        stations = self.get_stations(stations, self.stations[:1])
+        table = self.stage_table(scan_type, y_positions, x_positions, stations[0])
+        return self.submit(plans.Plan(scan_type, table, stations, repeats, sleep_time, testing))
+
+    def single(self, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan, see submit().
+
+        Parameters
+        ----------
+        stations : list
+            Station objects or tomoscan prefixes, the first station if None
+        repeats : int
+            Number of scans
+        sleep_time : float
+            Seconds to wait between repeats
+        testing : bool
+            If True no scan is started
+        """
+
+        return self.stage_plan('Single', None, None, stations, repeats, sleep_time, testing)
+
+    def sleep_series(self, repeats, sleep_time, stations=None, testing=False):
+        """Submits repeats single scans sleep_time seconds apart, see single()"""
+
+        return self.single(stations, repeats, sleep_time, testing)
+
+    def vertical(self, positions, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan at each vertical stage position (mm), see single()"""
+
+        return self.stage_plan('Vertical', positions, None, stations, repeats, sleep_time, testing)
+
+    def horizontal(self, positions, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan at each horizontal stage position (mm), see single()"""
+
+        return self.stage_plan('Horizontal', None, positions, stations, repeats, sleep_time, testing)
+
+    def mosaic(self, y_positions, x_positions, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan on each tile of a grid, Y the outer loop, see single()"""
+
+        return self.stage_plan('Mosaic', y_positions, x_positions, stations, repeats, sleep_time, testing)
+
+    def energy(self, energies, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan at each energy, changed via tomoscan, see single()"""
+
+        if not self.ready.wait(timeout=60):
+            raise RuntimeError('Not connected to the tomoscan servers')
+        stations = self.get_stations(stations, self.stations[:1])
+        energies = np.asarray(energies, dtype=float)
+        keys = np.char.add('Energy_', np.arange(len(energies)).astype(str))
+        table = scanfile.ScanTable(keys, {'Energy': energies})
+        return self.submit(plans.Plan('Energy File', table, stations, repeats, sleep_time, testing))
+
+    def scan_file(self, scan_file, stations=None, repeats=1, sleep_time=0, testing=False):
+        """Submits the entries of a scan file, shared by the stations, see single().
+
+        Parameters
+        ----------
+        scan_file : str or ScanTable
+            JSON or npz scan file name, or a loaded table
+        stations : list
+            Station objects or tomoscan prefixes, all stations if None
+        """
+
+        if not self.ready.wait(timeout=60):
+            raise RuntimeError('Not connected to the tomoscan servers')
+        table = scanfile.load(scan_file) if isinstance(scan_file, str) else scan_file
+        errors = table.validate()
+        if errors:
+            raise ValueError('scan file error: %s' % errors[0])
+        stations = self.get_stations(stations, self.stations)
+        return self.submit(plans.Plan('Scan File', table, stations, repeats, sleep_time, testing))
+
+    def execute(self, plan, future):
+        """Runs a plan, called by the plan queue.
+
+        Returns
+        -------
+        dict
+            Final 'state' (Done, Failed or Cancelled), number of 'steps'
+            done, keys of the 'failed' steps, keys of the 'skipped' steps
+            that were not run, as a range for a Nested plan, and move
+            'time_saved' (s).
+
+        Raises
+        ------
+        RuntimeError
+            If the plan cannot start: the first station is not running or
+            busy, or the plan does not pass the preflight checks.
+        """
+
+        if not self.ready.wait(timeout=60):
+            raise RuntimeError('Not connected to the tomoscan servers')
+        first = plan.stations[0]
+        if not first.is_running():
+            raise RuntimeError('Server %s is not runnig' % first.tomoscan_prefix)
+        if first.epics_pvs['TSScanStatus'].get(as_string=True) != 'Scan complete':
+            raise RuntimeError('Server %s is busy. Please run a scan manually first.' % first.tomoscan_prefix)
+        if plan.kind == 'Scan File' and len(plan.table) == 0:
+            raise RuntimeError('no valid scan file')
+        if not self.preflight(plan):
+            raise RuntimeError('preflight failed')
+        if not self.put_tomoscan({'TSScanType': plan.scan_type}, plan.stations):
+            raise RuntimeError('tomoscan ScanType not set')
+
+        tic_01 = time.time()
+        result = {'state': 'Done', 'steps': 0, 'failed': [], 'skipped': [], 'time_saved': 0.0}
+        future.abort = lambda: self.abort_stations(plan.stations)
+        future.publish('Running')
+        log.warning('%s scan start', plan.kind)
+        if plan.repeats > 1:
+            log.warning('running %d x %2.2fs sleep scans', plan.repeats, plan.sleep_time)
+        try:
+            for repeat in range(plan.repeats):
+                if not future.is_active():
+                    break
+                if plan.repeats > 1:
+                    log.warning('sleep start scan %d/%d', repeat, plan.repeats-1)
+                with trace.span('%s scan %d' % (plan.kind, repeat)):
+                    self.run_table(plan, future, repeat, result)
+                if repeat < plan.repeats - 1 and future.is_active():
+                    if plan.insitu is not None:
+                        in_situ_set_value = plan.insitu[0] + repeat * plan.insitu[1]
+                        log.error('in-situ set value: %3.3f ', in_situ_set_value)
+                        # set in-situ PV
+                        # wait on in-situ read back value
+                    log.warning('wait (s): %s ', str(plan.sleep_time))
+                    future.stop.wait(plan.sleep_time)
+        finally:
+            self.put_tomoscan({'TSScanType': 'Single'}, plan.stations)
+
+        if not future.is_active():
+            result['state'] = 'Cancelled'
+        elif result['failed'] or result['skipped']:
+            result['state'] = 'Failed'
+        self.get_plan_server(plan).finish(result['state'])
+        future.publish(result['state'])
+        dtime = (time.time() - tic_01)/60.
+        log.info('%s scan time: %3.3f minutes, %3.3f s saved by moving the axes together',
+                 plan.kind, dtime, result['time_saved'])
+        log.warning('%s scan end: %s', plan.kind, result['state'])
+        return result
+
+    def run_table(self, plan, future, repeat, result):
+        """Runs the single scans of the plan table once, adding the outcome to result"""
+
+        self.get_plan_server(plan).publish_plan(plan.table, plan.steps)
+        if plan.kind == 'Scan File':
+            log.info('file scan start')
+            dispatcher = station.Dispatcher(plan.stations, self.epics_pvs['ScanLibStatus'],
+                                            testing=plan.testing,
+                                            step_callback=lambda key, scan_station, state:
+                                            self.step_event(future, key, None, scan_station, state))
+            not_done = dispatcher.run(plan.table, future.is_active)
+            result['steps'] += dispatcher.done - len(dispatcher.failed)
+            result['failed'] += dispatcher.failed
+            # Entries no station took, e.g. when every station stopped running
+            result['skipped'] += [key for key in not_done if key not in dispatcher.failed]
+            return
+        if plan.kind == 'Energy File' and 'Energy' not in plan.table:
+            self.energy_scan()
+            return
+        if plan.kind == 'Nested':
+            self.run_nested(plan, future, repeat, result)
+            return
+
+        scan_station = plan.stations[0]
+        for index, (key, entry) in enumerate(plan.table.items()):
+            if not future.is_active():
+                log.warning('%s scan stopped at step %s', plan.kind, key)
+                result['skipped'] += [str(key) for key in plan.table.keys[index:]]
+                return
+            index += repeat * len(plan.table)
+            self.step_event(future, key, index, scan_station, 'Running')
+            state = 'Done'
+            try:
+                if 'Energy' in entry:
+                    energy = entry.pop('Energy')
+                    log.info('energy %.3f keV', energy)
+                    if not plan.testing:
+                        self.set_energy(energy, scan_station)
+                for name, position in entry.items():
+                    log.warning('%s stage start position: %3.3f mm', name, position)
+                if entry:
+                    # The axes move together, an axis already in place is not moved
+                    moved = scan_station.move_axes({'TS' + name: position for name, position in entry.items()})
+                    result['time_saved'] += moved.saved
+                    if not moved:
+                        raise RuntimeError('move of %s did not complete' % ', '.join(entry))
+                self.single_scan(scan_station, plan.testing)
+                result['steps'] += 1
+            except Exception as e:
+                log.error('%s step %s failed: %s', plan.kind, key, e)
+                state = 'Failed'
+                result['failed'].append(key)
+            self.step_event(future, key, index, scan_station, state)
+
+    def run_nested(self, plan, future, repeat, result):
+        """Runs the steps of a Nested plan once, adding the outcome to result.
+
+        An axis that cannot be set stops the plan, as the following steps
+        would run at the wrong position.
+        """
+
+        scan_station = plan.stations[0]
+        # Cancelling the plan cuts short the waits of the axes, e.g. of repeat_axis()
+        for axis in plan.nested.axes:
+            axis.stop = future.stop
+        for step in plan.nested:
+            key = 'Nested_%d' % step['index']
+            if not future.is_active():
+                log.warning('%s scan stopped at step %s', plan.kind, key)
+                result['skipped'].append('%s..Nested_%d' % (key, plan.steps - 1))
+                return
+            index = step['index'] + repeat * plan.steps
+            self.step_event(future, key, index, scan_station, 'Running')
+            try:
+                plan.nested.set_axes(step)
+            except Exception as e:
+                log.error('%s step %s: %s, scan stopped', plan.kind, key, e)
+                result['failed'].append(key)
+                if step['index'] + 1 < plan.steps:
+                    result['skipped'].append('Nested_%d..Nested_%d' % (step['index'] + 1, plan.steps - 1))
+                self.step_event(future, key, index, scan_station, 'Failed')
+                return
+            if not future.is_active():
+                # Cancelled while an axis was being set
+                log.warning('%s scan stopped at step %s', plan.kind, key)
+                result['skipped'].append('%s..Nested_%d' % (key, plan.steps - 1))
+                self.step_event(future, key, index, scan_station, 'Cancelled')
+                return
+            state = 'Done'
+            try:
+                self.single_scan(scan_station, plan.testing)
+                result['steps'] += 1
+            except Exception as e:
+                log.error('%s step %s failed: %s', plan.kind, key, e)
+                state = 'Failed'
+                result['failed'].append(key)
+            self.step_event(future, key, index, scan_station, state)
+
+    def get_plan_server(self, plan):
+        """Returns the pvAccess channels of the first station of plan.
+
+        Plans running at the same time have no station in common, so each
+        publishes to channels of its own.
+        """
+
+        return self.plan_servers.get(plan.stations[0].tomoscan_prefix, pvaserver.NoPlanServer())
+
+    def step_event(self, future, key, index, scan_station, state):
+        """Publishes the state of a step to the plan future and the pvAccess server"""
+
+        plan_server = self.get_plan_server(future.plan)
+        # Index of the step in the current repeat, for plans without a table
+        step = index % future.plan.steps if index is not None else None
+        if state == 'Running':
+            plan_server.start_step(key, step)
         else:
-            log.error('Server %s is not runnig', tomoscan_prefix)
+            plan_server.finish_step(key, scan_station.actual_positions(), state, step)
+        future.publish(state, key=key, index=index, scan_station=scan_station)
 
-    def scan(self):
+    def put_tomoscan(self, values, stations=None):
+        """Writes tomoscan PVs of several stations in one confirmed batch.
 
-        tic_01 =  time.time()
-        flat_field_axis = self.epics_pvs['TSFlatFieldAxis'].get(as_string=True)
-        flat_field_mode = self.epics_pvs['TSFlatFieldMode'].get(as_string=True)
-        scan_type = self.epics_pvs['ScanType'].get(as_string=True) 
-
-        if (scan_type == 'Single'):
-            self.single_scan()
-        elif (scan_type == 'Scan File'):
-            self.file_scan(self.fsname)   
-        elif (scan_type == 'Energy File'):
-            self.energy_scan()        
-        elif (scan_type == 'Mosaic'):
-            start_y = self.epics_pvs['VerticalStart'].get()
-            step_size_y = self.epics_pvs['VerticalStepSize'].get()  
-            steps_y = self.epics_pvs['VerticalSteps'].get()
-            end_y = start_y + (step_size_y * steps_y) 
+        Parameters
+        ----------
+        values : dict
+            tomoscan PV key -> value, e.g. {'TSScanType': 'Single'}
+        stations : list
+            Stations to write to, the first station if None
+
+        Returns
+        -------
+        bool
+            True if every PV was written and read back, failures are
+            reported in ScanLibStatus.
+        """
 
+        if stations is None:
+            stations = self.stations[:1]
+        writes = [(scan_station.epics_pvs[key], value)
+                  for scan_station in stations for key, value in values.items()]
+        result = putengine.put_batch(writes, confirm=True)
+        if not result.ok:
+            log.error('tomoscan put: %s', result.summary())
+            self.epics_pvs['ScanLibStatus'].put(('Put failed: ' + result.summary())[:255])
+        return result.ok
+
+    def move(self, pv_key, position):
+        """Moves a sample stage PV of the first station and records the move time.
+
+        The timeout is scaled to the move time predicted by motion.model.
+
+        Returns
+        -------
+        bool
+            True if the move completed before the timeout.
+        """
+
+        return self.stations[0].move(pv_key, position)
+
+    def move_axes(self, targets):
+        """Moves several sample stage PVs of the first station at the same time.
+
+        Parameters
+        ----------
+        targets : dict
+            PV key -> position
+
+        Returns
+        -------
+        MoveResult
+        """
+
+        return self.stations[0].move_axes(targets)
+
+    def predict_move_time(self, pv_key, position):
+        """Returns the expected time in s to move a PV to position, None if not calibrated yet"""
+
+        epics_pv = self.epics_pvs[pv_key]
+        return motion.model.predict(epics_pv.pvname, position - epics_pv.get())
+
+    def compile_plan(self):
+        """Returns the positions and parameters planned by the current scan type.
+
+        Returns
+        -------
+        ScanTable
+            One entry per single scan, see stage_table(). Scan types
+            without planned steps return an empty table.
+        """
+
+        scan_type = self.epics_pvs['ScanType'].get(as_string=True)
+        if scan_type == 'Scan File':
+            if self.scan_table is None:
+                return scanfile.ScanTable(np.array([], dtype=str), {})
+            return self.scan_table
+        y_positions = None
+        x_positions = None
+        if scan_type in ('Vertical', 'Mosaic'):
+            start_y = self.epics_pvs['VerticalStart'].get()
+            step_size_y = self.epics_pvs['VerticalStepSize'].get()
+            steps_y = int(self.epics_pvs['VerticalSteps'].get())
+            end_y = start_y + (step_size_y * steps_y)
+            y_positions = np.linspace(start_y, end_y, steps_y, endpoint=False)
+        if scan_type in ('Horizontal', 'Mosaic'):
             start_x = self.epics_pvs['HorizontalStart'].get()
             step_size_x = self.epics_pvs['HorizontalStepSize'].get()
-            steps_x = self.epics_pvs['HorizontalSteps'].get()  
+            steps_x = int(self.epics_pvs['HorizontalSteps'].get())
             end_x = start_x + (step_size_x * steps_x)
+            x_positions = np.linspace(start_x, end_x, steps_x, endpoint=False)
+        return self.stage_table(scan_type, y_positions, x_positions)
 
-            log.info('vertical positions (mm): %s', np.linspace(start_y, end_y, steps_y, endpoint=False))
-            for i in np.linspace(start_y, end_y, steps_y, endpoint=False):
-                log.warning('%s stage start position: %3.3f mm', 'SampleInY', i)
-                if flat_field_axis in ('X') or flat_field_mode == 'None':
-                    pv_y = "TSSampleY"
-                else:
-                    pv_y = "TSSampleInY"
-                self.epics_pvs[pv_y].put(i, wait=True)
-                log.info('horizontal positions (mm): %s', np.linspace(start_x, end_x, steps_x, endpoint=False))
-                for j in np.linspace(start_x, end_x, steps_x, endpoint=False):
-                    log.warning('%s stage start position: %3.3f mm', 'SampleInX', j)
-                    if flat_field_axis in ('Y') or flat_field_mode == 'None':
-                        pv_x = "TSSampleX"
-                    else:
-                        pv_x = "TSSampleInX"
-                    self.epics_pvs[pv_x].put(j, wait=True, timeout=600)
-                    self.single_scan()
-            dtime = (time.time() - tic_01)/60.
-            log.info('%s scan time: %3.3f minutes', scan_type, dtime)
+    def stage_table(self, scan_type, y_positions=None, x_positions=None, scan_station=None):
+        """Returns the plan table of a Single, Vertical, Horizontal or Mosaic scan.
+
+        Parameters
+        ----------
+        scan_type : str
+            Scan type, other types than the above return an empty table
+        y_positions, x_positions : sequence
+            Vertical and horizontal stage positions in mm, Y is the outer
+            loop of a Mosaic
+        scan_station : Station
+            Station whose flat field settings select the stage PVs, the
+            first station if None
+
+        Returns
+        -------
+        ScanTable
+            One entry per single scan. Stage positions are stored under the
+            name of the tomoscan PV they are written to without the 'TS',
+            e.g. SampleX or SampleInX. A Single scan has one entry without
+            columns.
+        """
+
+        scan_station = scan_station if scan_station is not None else self.stations[0]
+        pv_y, pv_x = scan_station.sample_axes()
+        columns = {}
+        if y_positions is not None and scan_type in ('Vertical', 'Mosaic'):
+            columns[pv_y[2:]] = np.asarray(y_positions, dtype=float)
+        if x_positions is not None and scan_type in ('Horizontal', 'Mosaic'):
+            columns[pv_x[2:]] = np.asarray(x_positions, dtype=float)
+        if scan_type == 'Mosaic' and len(columns) == 2:
+            # Y is the outer loop, X the inner loop
+            steps_x = len(columns[pv_x[2:]])
+            columns[pv_y[2:]] = np.repeat(columns[pv_y[2:]], steps_x)
+            columns[pv_x[2:]] = np.tile(columns[pv_x[2:]], len(columns[pv_y[2:]]) // max(steps_x, 1))
+        if columns:
+            steps = len(next(iter(columns.values())))
         else:
-            if (scan_type == 'Horizontal'):
-                start = self.epics_pvs['HorizontalStart'].get()
-                step_size = self.epics_pvs['HorizontalStepSize'].get()       
-                steps = self.epics_pvs['HorizontalSteps'].get()
-                end = start + (step_size * steps)
-                log.info('horizontal positions (mm): %s', np.linspace(start, end, steps, endpoint=False))
-                if flat_field_axis in ('Y') or flat_field_mode == 'None':
-                    pv = "TSSampleX"
-                else:
-                    pv = "TSSampleInX"
-            elif (scan_type == 'Vertical'):
-                start = self.epics_pvs['VerticalStart'].get()
-                step_size = self.epics_pvs['VerticalStepSize'].get()
-                steps = int(self.epics_pvs['VerticalSteps'].get())
-                end = start + (step_size * steps)
-                log.info('vertical positions (mm): %s', np.linspace(start, end, steps, endpoint=False))
-                if flat_field_axis in ('X') or flat_field_mode == 'None':
-                    pv = "TSSampleY" ######
-                else:
-                    pv = "TSSampleInY"
-            for i in np.linspace(start, end, steps, endpoint=False):
-                log.warning('%s stage start position: %3.3f mm', pv, i)
-                self.epics_pvs[pv].put(i, wait=True, timeout=600)
-                self.single_scan()
-            dtime = (time.time() - tic_01)/60.
-            log.info('%s scan time: %3.3f minutes', scan_type, dtime)
-
-        self.epics_pvs['TSScanType'].put('Single', wait=True)
-
-    def single_scan(self):
+            steps = 1 if scan_type == 'Single' else 0
+        keys = np.char.add('%s_' % scan_type, np.arange(steps).astype(str))
+        return scanfile.ScanTable(keys, columns)
 
-        testing_select  = self.epics_pvs['TestingSelect'].get(as_string=True)
+    def preflight(self, plan=None):
+        """Checks the whole plan against motor limits and tomoscan enum choices.
+
+        All the violations are logged and summarised in ScanLibStatus.
+
+        Parameters
+        ----------
+        plan : Plan
+            Plan to check, the plan set in the PVs if None
+
+        Returns
+        -------
+        bool
+            True if the plan can run.
+        """
+
+        tic_01 = time.time()
+        if plan is None:
+            plan = self.plan_from_pvs()
+        errors = []
+        if plan.kind == 'Scan File':
+            errors += plan.table.validate()
+        tables = [plan.table] if plan.table is not None else []
+        if plan.nested is not None:
+            # The stage axes are checked one by one, the steps are never materialised
+            tables = [scanfile.ScanTable(np.char.add('%s_' % axis.name, np.arange(len(axis)).astype(str)),
+                                         {axis.name[2:]: np.asarray(axis.positions, dtype=float)})
+                      for axis in plan.nested.axes if axis.name in plan.stations[0].epics_pvs]
+        for plan_station in plan.stations:
+            limits = preflight.read_limits(plan_station.epics_pvs)
+            choices = preflight.read_choices(plan_station.epics_pvs)
+            for table in tables:
+                errors += ['%s %s' % (plan_station.tomoscan_prefix, error)
+                           for error in preflight.check(table, limits, choices)]
+        preflight.report(errors, self.epics_pvs['ScanLibStatus'])
+        log.info('preflight of %d steps: %d violations in %3.3f s', plan.steps, len(errors),
+                 time.time() - tic_01)
+        return len(errors) == 0
+
+    def stage_axis(self, direction, positions, cost=1.0):
+        """Returns a nested scan axis moving the sample stage.
+
+        Parameters
+        ----------
+        direction : str
+            'X' or 'Y'
+        positions : sequence
+            Stage positions in mm
+        cost : float
+            Expected time in seconds of one move
+        """
+
+        flat_field_axis = self.epics_pvs['TSFlatFieldAxis'].get(as_string=True)
+        flat_field_mode = self.epics_pvs['TSFlatFieldMode'].get(as_string=True)
+        other = 'Y' if direction == 'X' else 'X'
+        if flat_field_axis in (other) or flat_field_mode == 'None':
+            pv = 'TSSample' + direction
+        else:
+            pv = 'TSSampleIn' + direction
+        def setter(position):
+            if not self.move(pv, position):
+                raise RuntimeError('move of %s to %s did not complete' % (pv, position))
+        return nested.Axis(pv, positions, setter, cost)
+
+    def energy_axis(self, energies, cost=30.0):
+        """Returns a nested scan axis changing the energy via tomoscan"""
+
+        return nested.Axis('Energy', energies, self.set_energy, cost)
+
+    def set_energy(self, energy, scan_station=None):
+        """Changes the energy via tomoscan on scan_station, the first station if None.
+
+        Raises
+        ------
+        RuntimeError
+            If the energy or the energy change could not be written
+        """
+
+        scan_station = scan_station if scan_station is not None else self.stations[0]
+        tomoscan_prefix = scan_station.tomoscan_prefix
+        for name, value, timeout in (('Energy', energy, 30), ('StartEnergyChange', 1, 3600)):
+            status = pvpool.get_pv(tomoscan_prefix + name, pin=True).put(value, wait=True, timeout=timeout)
+            if status != 1:
+                raise RuntimeError('put %s%s = %s not completed (status %s)' % (tomoscan_prefix, name, value, status))
+
+    def insitu_axis(self, values, cost=60.0):
+        """Returns a nested scan axis writing the in-situ PV set in InsituPVName"""
+
+        return nested.pv_axis('Insitu', self.epics_pvs['Insitu'], values, cost, timeout=3600)
+
+    def nested_scan(self, axes, order='auto', repeats=1, sleep_time=0, testing=False):
+        """Submits a single scan at every step of a nested scan, see single().
+
+        The scan runs on the first station, like the axes from stage_axis().
+
+        Parameters
+        ----------
+        axes : list
+            nested.Axis objects, e.g. from stage_axis(), energy_axis(),
+            insitu_axis() and nested.repeat_axis(). A setter raising an
+            exception stops the scan.
+        order : str or list
+            'auto' or the axis names from outermost to innermost,
+            see nested.NestedScan
+        """
+
+        if not self.ready.wait(timeout=60):
+            raise RuntimeError('Not connected to the tomoscan servers')
+        return self.submit(plans.Plan('Nested', None, self.stations[:1], repeats, sleep_time, testing,
+                                      nested=nested.NestedScan(axes, order)))
+
+    def single_scan(self, scan_station=None, testing=None):
+        """Runs one tomoscan scan and waits for it to complete.
+
+        Parameters
+        ----------
+        scan_station : Station
+            Station running the scan, the first station if None
+        testing : bool
+            If True no scan is started, read from TestingSelect if None
+        """
+
+        scan_station = scan_station if scan_station is not None else self.stations[0]
+        if testing is None:
+            testing = self.epics_pvs['TestingSelect'].get(as_string=True) == 'Yes'
 
         tic_01 =  time.time()
         log.info('single scan start')
-        if testing_select == 'Yes':
+        if testing:
             log.warning('testing mode')
         else: 
-            self.epics_pvs['TSStartScan'].put(1, wait=True, timeout=360000) # -1 - no timeout means timeout=0
+            scan_station.start_scan()
         dtime = (time.time() - tic_01)/60.
         log.info('single scan time: %3.3f minutes', dtime)
 
@@ -434,8 +1053,8 @@ class ScanLib():
         tic_01 =  time.time()
         log.info('energy scan start')
         
-        self.epics_pvs['TSStartEnergyChange'] = PV(tomoscan_prefix + 'StartEnergyChange')    
-        self.epics_pvs['TSEnergy'] = PV(tomoscan_prefix + 'Energy')    
+        self.epics_pvs['TSStartEnergyChange'] = pvpool.get_pv(tomoscan_prefix + 'StartEnergyChange', pin=True)    
+        self.epics_pvs['TSEnergy'] = pvpool.get_pv(tomoscan_prefix + 'Energy', pin=True)    
         
         # # need to handle file name passing
         # energies = np.load(args.file_energies)    
@@ -503,61 +1122,3 @@ class ScanLib():
         # dtime = (time.time() - tic_01)/60.
         # log.info('energy scan time: %3.3f minutes', dtime)
         # self.epics_pvs['TSScanType'].put('Single', wait=True)
-
-    def file_scan(self, fname):
-
-        tic_01 =  time.time()
-        log.info('file scan start')
-        # need to handle file name passing
-
-        if self.epics_pvs['ScanFileOK'].get() == 1:
-            flat_field_axis = self.epics_pvs['TSFlatFieldAxis'].get(as_string=True)
-            flat_field_mode = self.epics_pvs['TSFlatFieldMode'].get(as_string=True)
-
-            for key, value in scan_dict.items():
-
-                self.epics_pvs['TSSampleX'].put(value['SampleX'], wait=True)
-                self.epics_pvs['TSSampleY'].put(value['SampleY'], wait=True)
-                self.epics_pvs['TSRotationStart'].put(value['RotationStart'], wait=True) 
-                self.epics_pvs['TSRotationStep'].put(value['RotationStep'], wait=True)
-                self.epics_pvs['TSNumAngles'].put(value['NumAngles'], wait=True) 
-                self.epics_pvs['TSReturnRotation'].put(value['ReturnRotation'], wait=True) 
-                self.epics_pvs['TSNumDarkFields'].put(value['NumDarkFields'], wait=True) 
-                self.epics_pvs['TSDarkFieldMode'].put(value['DarkFieldMode'], wait=True) 
-                self.epics_pvs['TSDarkFieldValue'].put(value['DarkFieldValue'], wait=True) 
-                self.epics_pvs['TSNumFlatFields'].put(value['NumFlatFields'], wait=True) 
-                self.epics_pvs['TSFlatFieldAxis'].put(value['FlatFieldAxis'], wait=True) 
-                self.epics_pvs['TSFlatFieldMode'].put(value['FlatFieldMode'], wait=True) 
-                self.epics_pvs['TSFlatFieldValue'].put(value['FlatFieldValue'], wait=True) 
-                self.epics_pvs['TSFlatExposureTime'].put(value['FlatExposureTime'], wait=True) 
-                self.epics_pvs['TSDifferentFlatExposure'].put(value['DifferentFlatExposure'], wait=True) 
-                self.epics_pvs['TSSampleInX'].put(value['SampleInX'], wait=True) 
-                self.epics_pvs['TSSampleOutX'].put(value['SampleOutX'], wait=True) 
-                self.epics_pvs['TSSampleInY'].put(value['SampleInY'], wait=True) 
-                self.epics_pvs['TSSampleOutY'].put(value['SampleOutY'], wait=True) 
-                self.epics_pvs['TSSampleOutAngleEnable'].put(value['SampleOutAngleEnable'], wait=True) 
-                self.epics_pvs['TSSampleOutAngle'].put(value['SampleOutAngle'], wait=True) 
-                self.epics_pvs['TSScanType'].put(value['ScanType'], wait=True) 
-                self.epics_pvs['TSFlipStitch'].put(value['FlipStitch'], wait=True) 
-                self.epics_pvs['TSExposureTime'].put(value['ExposureTime'], wait=True)
-
-                log.warning('Scan key/number: %s ', key)
-                log.warning('%s stage position: %3.3f mm', 'Sample Y', value['SampleY'])
-                log.warning('%s stage position: %3.3f mm', 'Sample X', value['SampleX'])
-                if flat_field_axis in ('X') or flat_field_mode == 'None':
-                    pv_y = "TSSampleY"
-                else:
-                    pv_y = "TSSampleInY"
-                self.epics_pvs[pv_y].put(value['SampleY'], wait=True)
-                if flat_field_axis in ('Y') or flat_field_mode == 'None':
-                    pv_x = "TSSampleX"
-                else:
-                    pv_x = "TSSampleInX"
-                self.epics_pvs[pv_x].put(value['SampleX'], wait=True, timeout=600)
-                # single_scan(args, ts)
-                # config.write(args.config, args, sections=config.SINGLE_SCAN_PARAMS)
-
-            dtime = (time.time() - tic_01)/60.
-            log.info('file scan time: %3.3f minutes', dtime)
-            self.epics_pvs['TSScanType'].put('Single', wait=True)
-
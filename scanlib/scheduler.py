@@ -0,0 +1,141 @@
+'''
+    Process-wide scheduler of periodic tasks and callback work
+
+    One timer thread runs the periodic tasks of every ScanLib instance of
+    the process (watchdogs, eviction of idle PV channels, ...) and short
+    pieces of work triggered by PV callbacks run on one shared pool of
+    worker threads, so adding an instance adds no thread.
+'''
+import time
+import heapq
+import itertools
+import threading
+import concurrent.futures
+
+from scanlib import log
+
+# Number of threads running the callback work of all instances
+MAX_WORKERS = 4
+
+
+class Task():
+    """Periodic task of a Scheduler, returned by Scheduler.every()"""
+
+    def __init__(self, name, interval, function):
+
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.cancelled = False
+        self.runs = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return 'Task(%s, every %s s)' % (self.name, self.interval)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler():
+    """Runs periodic tasks from one timer thread and callback work on a shared pool.
+
+        Parameters
+        ----------
+        max_workers : int
+            Number of threads running the work passed to submit()
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+
+        self.max_workers = max_workers
+        self.lock = threading.Condition()
+        self.queue = []
+        self.tasks = {}
+        self.counter = itertools.count()
+        self.thread = None
+        self.executor = None
+
+    def every(self, interval, function, name=None):
+        """Calls function every interval seconds from the timer thread.
+
+        Tasks must return quickly, long work should be passed to submit().
+
+        Parameters
+        ----------
+        interval : float
+            Period in seconds, the first call is immediate
+        function : callable
+            Called without arguments
+        name : str
+            Task name, a task already scheduled with the same name is
+            returned instead of scheduling a new one
+
+        Returns
+        -------
+        Task
+        """
+
+        name = name if name is not None else repr(function)
+        with self.lock:
+            task = self.tasks.get(name)
+            if task is not None and not task.cancelled:
+                return task
+            task = Task(name, interval, function)
+            self.tasks[name] = task
+            heapq.heappush(self.queue, (time.monotonic(), next(self.counter), task))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='scanlib-scheduler', daemon=True)
+                self.thread.start()
+            self.lock.notify()
+        return task
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.lock.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                due, _, task = heapq.heappop(self.queue)
+            if task.cancelled:
+                with self.lock:
+                    if self.tasks.get(task.name) is task:
+                        del self.tasks[task.name]
+                continue
+            try:
+                task.function()
+            except Exception as e:
+                task.errors += 1
+                log.error('scheduled task %s failed: %s', task.name, e)
+            task.runs += 1
+            with self.lock:
+                # Keep the period without drifting, skipping missed runs
+                due = max(due + task.interval, time.monotonic())
+                heapq.heappush(self.queue, (due, next(self.counter), task))
+
+    def submit(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) on the shared worker threads, returns a Future"""
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='scanlib-worker')
+            executor = self.executor
+        future = executor.submit(function, *args, **kwargs)
+        future.add_done_callback(log_exception)
+        return future
+
+    def stats(self):
+        """Returns the number of scheduled tasks and of threads of the process"""
+
+        with self.lock:
+            return {'tasks': len([task for task in self.tasks.values() if not task.cancelled]),
+                    'workers': len(self.executor._threads) if self.executor is not None else 0,
+                    'threads': threading.active_count()}
+
+
+def log_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error('callback work failed: %s', future.exception())
+
+
+scheduler = Scheduler()
@@ -0,0 +1,92 @@
+'''
+    Simulated PVs
+
+    In-process replacement for epics.PV used by the 'sim' backend of the PV
+    pool, so ScanLib can be started and timed without any IOC. Puts complete
+    immediately and fire the monitor callbacks. The readback (.RBV) of a
+    simulated motor follows the value put to the motor.
+'''
+import threading
+
+# Simulated PVs by name, used to resolve the motor of a readback PV
+pvs = {}
+
+
+def default_value(pvname):
+    """Returns the initial value of a simulated PV.
+
+    PVPrefix PVs hold a prefix made of their name, e.g. 2bmb:ScanLib:TomoscanPVPrefix
+    -> Tomoscan:, PVName PVs hold a PV name, e.g. sim:SampleX, others hold 0.
+    """
+
+    name = pvname.split(':')[-1]
+    if name.endswith('PVPrefix'):
+        return name[:-len('PVPrefix')] + ':'
+    if name.endswith('PVName'):
+        return 'sim:' + name[:-len('PVName')]
+    return 0
+
+
+class SimPV():
+    """Simulated PV implementing the parts of the epics.PV interface used by ScanLib"""
+
+    def __init__(self, pvname, connection_callback=None, **kwargs):
+
+        self.pvname = pvname
+        self.lock = threading.Lock()
+        self._value = default_value(pvname)
+        self.callbacks = {}
+        self.connected = True
+        self.enum_strs = None
+        self.put_complete = True
+        pvs[pvname] = self
+        if connection_callback is not None:
+            connection_callback(pvname=pvname, conn=True)
+
+    @property
+    def value(self):
+        return self.get()
+
+    def get(self, count=None, as_string=False, **kwargs):
+        motor = self.motor()
+        if motor is not None:
+            return motor.get(count, as_string)
+        with self.lock:
+            value = self._value
+        return str(value) if as_string else value
+
+    def motor(self):
+        """Returns the simulated motor of a readback PV, None for other PVs"""
+
+        if not self.pvname.endswith('.RBV'):
+            return None
+        record = self.pvname[:-len('.RBV')]
+        return pvs.get(record, pvs.get(record + '.VAL'))
+
+    def put(self, value, wait=False, timeout=30.0, use_complete=False, callback=None,
+            callback_data=None, **kwargs):
+        with self.lock:
+            self._value = value
+            callbacks = list(self.callbacks.values())
+        for monitor in callbacks:
+            monitor(pvname=self.pvname, value=value, char_value=str(value))
+        if callback is not None:
+            callback(pvname=self.pvname, data=callback_data)
+        return 1
+
+    def add_callback(self, callback, index=None, **kwargs):
+        with self.lock:
+            if index is None:
+                index = len(self.callbacks)
+            self.callbacks[index] = callback
+        return index
+
+    def remove_callback(self, index=None):
+        with self.lock:
+            self.callbacks.pop(index, None)
+
+    def wait_for_connection(self, timeout=None):
+        return True
+
+    def disconnect(self):
+        self.connected = False
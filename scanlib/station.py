@@ -0,0 +1,351 @@
+'''
+    Tomoscan stations and dispatch of scan file entries
+
+    A station is one tomoscan server, identified by its PV prefix. When
+    several stations are configured, each station takes the next entry of
+    the scan file as soon as it is idle, so the throughput scales with the
+    number of stations. Entries are read one at a time, a long scan file is
+    never copied into a work queue.
+'''
+import time
+import threading
+
+from scanlib import log
+from scanlib import pvpool
+from scanlib import scanfile
+from scanlib import preflight
+from scanlib import motion
+from scanlib import putengine
+
+# tomoscan PVs used by ScanLib, available as 'TS' + name
+TOMOSCAN_PVS = (
+    'StartScan',
+    'AbortScan',
+    'ServerRunning',
+    'ScanStatus',
+    'SampleName',
+    'RotationStart',
+    'RotationStep',
+    'NumAngles',
+    'ReturnRotation',
+    'NumDarkFields',
+    'DarkFieldMode',
+    'DarkFieldValue',
+    'NumFlatFields',
+    'FlatFieldAxis',
+    'FlatFieldMode',
+    'FlatFieldValue',
+    'FlatExposureTime',
+    'DifferentFlatExposure',
+    'SampleInX',
+    'SampleOutX',
+    'SampleInY',
+    'SampleOutY',
+    'SampleOutAngleEnable',
+    'SampleOutAngle',
+    'ScanType',
+    'FlipStitch',
+    'ExposureTime',
+)
+
+
+def tomoscan_pvs(tomoscan_prefix):
+    """Returns the pooled tomoscan PVs of a station keyed by 'TS' + name.
+
+    TSSampleX and TSSampleY are the sample stage motors named by the
+    tomoscan SampleXPVName and SampleYPVName PVs.
+
+    Raises
+    ------
+    RuntimeError
+        If the sample stage motor names cannot be read, e.g. tomoscan is down
+    """
+
+    epics_pvs = {}
+    sample_x_pv_name = pvpool.get_pv(tomoscan_prefix + 'SampleXPVName', pin=True).get(as_string=True)
+    sample_y_pv_name = pvpool.get_pv(tomoscan_prefix + 'SampleYPVName', pin=True).get(as_string=True)
+    if not sample_x_pv_name or not sample_y_pv_name:
+        raise RuntimeError('cannot read %sSampleXPVName and SampleYPVName' % tomoscan_prefix)
+    epics_pvs['TSSampleX'] = pvpool.get_pv(sample_x_pv_name, pin=True)
+    epics_pvs['TSSampleY'] = pvpool.get_pv(sample_y_pv_name, pin=True)
+    for name in TOMOSCAN_PVS:
+        epics_pvs['TS' + name] = pvpool.get_pv(tomoscan_prefix + name, pin=True)
+    return epics_pvs
+
+
+class Station():
+    """One tomoscan server.
+
+        Parameters
+        ----------
+        tomoscan_prefix : str
+            PV prefix of the tomoscan server
+        epics_pvs : dict
+            tomoscan PVs as returned by tomoscan_pvs(), created if None
+    """
+
+    def __init__(self, tomoscan_prefix, epics_pvs=None):
+
+        self.tomoscan_prefix = tomoscan_prefix
+        self.epics_pvs = epics_pvs if epics_pvs is not None else tomoscan_pvs(tomoscan_prefix)
+        self.current = None
+        self.entries_done = 0
+
+    def __repr__(self):
+        return 'Station(%s)' % self.tomoscan_prefix
+
+    def is_running(self):
+        return bool(self.epics_pvs['TSServerRunning'].get())
+
+    def is_ready(self):
+        """True if the tomoscan server is running and not scanning"""
+
+        return (self.is_running() and
+                self.epics_pvs['TSScanStatus'].get(as_string=True) == 'Scan complete')
+
+    def sample_axes(self, flat_field_axis=None, flat_field_mode=None):
+        """Returns the names of the PVs used to move the sample in Y and X.
+
+        The 'in' positions are used when the flat fields move the sample
+        out along the other axis.
+
+        Parameters
+        ----------
+        flat_field_axis, flat_field_mode : str
+            Flat field settings the sample is moved for, read from
+            tomoscan if None
+        """
+
+        if flat_field_axis is None:
+            flat_field_axis = self.epics_pvs['TSFlatFieldAxis'].get(as_string=True)
+        if flat_field_mode is None:
+            flat_field_mode = self.epics_pvs['TSFlatFieldMode'].get(as_string=True)
+        if flat_field_axis in ('X') or flat_field_mode == 'None':
+            pv_y = "TSSampleY"
+        else:
+            pv_y = "TSSampleInY"
+        if flat_field_axis in ('Y') or flat_field_mode == 'None':
+            pv_x = "TSSampleX"
+        else:
+            pv_x = "TSSampleInX"
+        return pv_y, pv_x
+
+    def actual_positions(self):
+        """Returns the readback positions of the sample stage motors keyed by PV key"""
+
+        return {key: motion.motor_readback(self.epics_pvs[key]).get() for key in preflight.MOTOR_COLUMNS}
+
+    def readback(self, pv_key):
+        """Returns the motor readback PV of a sample stage motor PV key, None for other PVs.
+
+        The 'in' positions, e.g. TSSampleInX, are tomoscan parameters, not
+        motors, their setpoint is all there is to compare.
+        """
+
+        if pv_key not in preflight.MOTOR_COLUMNS:
+            return None
+        return motion.motor_readback(self.epics_pvs[pv_key])
+
+    def move(self, pv_key, position):
+        """Moves a sample stage PV, with a timeout scaled to the expected move time"""
+
+        return motion.move(self.epics_pvs[pv_key], position, self.readback(pv_key))
+
+    def move_axes(self, targets):
+        """Moves several sample stage PVs at the same time.
+
+        Parameters
+        ----------
+        targets : dict
+            PV key -> position, e.g. {'TSSampleY': 1.0, 'TSSampleX': 2.0}
+
+        Returns
+        -------
+        MoveResult
+            ok is True if every move completed before its timeout.
+        """
+
+        return motion.move_axes([(self.epics_pvs[pv_key], position, self.readback(pv_key))
+                                 for pv_key, position in targets.items()])
+
+    def set_entry(self, key, value):
+        """Writes the parameters of a scan file entry and moves the sample.
+
+        The tomoscan parameters are written in one confirmed batch, the
+        sample stage motors are then moved together.
+
+        Raises
+        ------
+        RuntimeError
+            If a parameter could not be written or a move did not complete
+        """
+
+        # The axes follow the flat field settings of this entry, not those of the previous one
+        pv_y, pv_x = self.sample_axes(value['FlatFieldAxis'], value['FlatFieldMode'])
+        writes = [(self.epics_pvs['TS' + name], value[name]) for name in scanfile.SCAN_PARAMS
+                  if 'TS' + name not in preflight.MOTOR_COLUMNS]
+        result = putengine.put_batch(writes, confirm=True)
+        log.info('%s entry %s parameters: %s', self.tomoscan_prefix, key, result.summary())
+        if not result.ok:
+            raise RuntimeError(result.summary())
+
+        log.warning('%s scan key/number: %s ', self.tomoscan_prefix, key)
+        log.warning('%s stage position: %3.3f mm', 'Sample Y', value['SampleY'])
+        log.warning('%s stage position: %3.3f mm', 'Sample X', value['SampleX'])
+        targets = {'TSSampleY': value['SampleY'], 'TSSampleX': value['SampleX']}
+        targets[pv_y] = value['SampleY']
+        targets[pv_x] = value['SampleX']
+        if not self.move_axes(targets):
+            raise RuntimeError('move of %s did not complete' % ', '.join(targets))
+
+    def start_scan(self):
+        """Starts a tomoscan scan and waits for it to complete"""
+
+        self.epics_pvs['TSStartScan'].put(1, wait=True, timeout=360000) # -1 - no timeout means timeout=0
+
+
+class Dispatcher():
+    """Runs scan file entries on several stations, each taking the next entry when idle.
+
+        Parameters
+        ----------
+        stations : list
+            Station objects
+        status_pv : PV
+            PV receiving the merged progress, e.g. ScanLibStatus
+        testing : bool
+            If True entries are set but no scan is started
+        poll_time : float
+            Seconds between checks of a busy station
+        step_callback : callable
+            Called as step_callback(key, station, state) when an entry
+            starts ('Running') and ends ('Done' or 'Failed')
+    """
+
+    def __init__(self, stations, status_pv=None, testing=False, poll_time=1.0, step_callback=None):
+
+        self.stations = stations
+        self.status_pv = status_pv
+        self.testing = testing
+        self.poll_time = poll_time
+        self.step_callback = step_callback
+        self.lock = threading.Lock()
+        self.entries = iter(())
+        self.taken = 0
+        self.sized = False
+        self.total = 0
+        self.done = 0
+        self.failed = []
+
+    def progress(self):
+        """Returns the merged progress of all stations as a string"""
+
+        with self.lock:
+            stations = ', '.join('%s: %s' % (station.tomoscan_prefix, station.current or 'idle')
+                                 for station in self.stations)
+            return '%d/%d done; %s' % (self.done, self.total, stations)
+
+    def report(self):
+        progress = self.progress()
+        log.info(progress)
+        if self.status_pv is not None:
+            self.status_pv.put(progress[:255])
+
+    def wait_ready(self, station, is_running):
+        """Waits until station is idle, returns False if it is not running or the scan stops"""
+
+        while is_running():
+            if not station.is_running():
+                log.error('Server %s is not running', station.tomoscan_prefix)
+                return False
+            if station.is_ready():
+                return True
+            time.sleep(self.poll_time)
+        return False
+
+    def next_entry(self, station):
+        """Takes the next (key, entry) pair for station, None once all entries are taken"""
+
+        with self.lock:
+            try:
+                key, value = next(self.entries)
+            except StopIteration:
+                return None
+            self.taken += 1
+            if not self.sized:
+                self.total += 1
+            station.current = key
+        return key, value
+
+    def worker(self, station, is_running):
+        while is_running():
+            if not self.wait_ready(station, is_running):
+                return
+            pair = self.next_entry(station)
+            if pair is None:
+                return
+            key, value = pair
+            self.report()
+            state = 'Done'
+            if self.step_callback is not None:
+                self.step_callback(key, station, 'Running')
+            try:
+                station.set_entry(key, value)
+                if self.testing:
+                    log.warning('testing mode')
+                else:
+                    station.start_scan()
+            except Exception as e:
+                log.error('%s entry %s failed: %s', station.tomoscan_prefix, key, e)
+                state = 'Failed'
+                with self.lock:
+                    self.failed.append(key)
+            if self.step_callback is not None:
+                self.step_callback(key, station, state)
+            with self.lock:
+                station.current = None
+                station.entries_done += 1
+                self.done += 1
+            self.report()
+
+    def run(self, entries, is_running=lambda: True):
+        """Runs all entries and returns once they are all taken or the scan stops.
+
+        Parameters
+        ----------
+        entries : ScanTable or iterable
+            Scan table, or (key, entry) pairs read one at a time as the
+            stations become idle
+        is_running : callable
+            Checked between entries, the dispatch stops when it returns False
+
+        Returns
+        -------
+        list
+            Keys of the entries that were not completed
+        """
+
+        self.sized = hasattr(entries, '__len__')
+        self.total = len(entries) if self.sized else 0
+        self.taken = 0
+        self.entries = iter(entries.items() if isinstance(entries, scanfile.ScanTable) else entries)
+        threads = [threading.Thread(target=self.worker, args=(station, is_running), daemon=True)
+                   for station in self.stations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        not_done = list(self.failed)
+        with self.lock:
+            if isinstance(entries, scanfile.ScanTable):
+                # The entries not taken are not built only to get their keys
+                not_done += list(entries.keys[self.taken:])
+            else:
+                not_done += [key for key, _ in self.entries]
+        for station in self.stations:
+            log.info('%s ran %d entries', station.tomoscan_prefix, station.entries_done)
+        if not_done:
+            log.error('entries not completed: %s', ', '.join(not_done))
+        self.report()
+        return not_done
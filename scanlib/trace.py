@@ -0,0 +1,363 @@
+'''
+    PV operation trace recorder and replay analyser
+
+    When enabled, every put and get done through the PV pool, and every
+    span marked with ``trace.span()``, is stored in a fixed size binary ring
+    buffer. The buffer can be dumped to an npz file and analysed offline:
+
+    python -m scanlib.trace trace.npz
+
+    prints the latency report of the recorded trace and of its replay
+    against a simulated backend, including the critical path of the run.
+    Tracing is off by default; set the SCANLIB_TRACE environment variable
+    to any non-empty value (e.g. 1) or call ``trace.enable()`` to turn it
+    on. SCANLIB_TRACE_SIZE sets the ring buffer size in events.
+'''
+import os
+import time
+import argparse
+import threading
+import contextlib
+
+from scanlib import log
+from scanlib import util
+
+np = util.lazy_import('numpy')
+
+OPS = ('get', 'put', 'put_wait', 'span')
+
+# Ring buffer size used when SCANLIB_TRACE_SIZE is not a positive integer
+DEFAULT_SIZE = 65536
+
+EVENT_FIELDS = [
+    ('op', 'u1'),
+    ('name', 'u4'),
+    ('thread', 'u4'),
+    ('value', 'f8'),
+    ('start', 'f8'),
+    ('end', 'f8'),
+]
+
+
+class TraceRecorder():
+    """Ring buffer of PV operations.
+
+        Parameters
+        ----------
+        size : int
+            Number of events kept, older events are overwritten.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.resize(size)
+
+    def resize(self, size):
+        """Empties the buffer, it is allocated with size events on the first record"""
+
+        with self.lock:
+            self.size = size
+            self.events = None
+            self.count = 0
+            self.names = {}
+            self.threads = {}
+
+    def _intern(self, table, key):
+        index = table.get(key)
+        if index is None:
+            index = table[key] = len(table)
+        return index
+
+    def record(self, op, name, value, start, end, thread=None):
+        """Stores one event, value is kept only when it is a number.
+
+        The event belongs to the calling thread unless another thread name is given.
+        """
+
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = np.nan
+        with self.lock:
+            if self.events is None:
+                self.events = np.zeros(self.size, dtype=EVENT_FIELDS)
+            self.events[self.count % len(self.events)] = (
+                OPS.index(op), self._intern(self.names, name),
+                self._intern(self.threads, thread if thread is not None else threading.current_thread().name),
+                value, start, end)
+            self.count += 1
+
+    def snapshot(self):
+        """Returns the recorded events, oldest first"""
+
+        with self.lock:
+            if self.events is None:
+                self.events = np.zeros(self.size, dtype=EVENT_FIELDS)
+            size = len(self.events)
+            if self.count <= size:
+                events = self.events[:self.count].copy()
+            else:
+                head = self.count % size
+                events = np.concatenate((self.events[head:], self.events[:head]))
+            names = list(self.names)
+            threads = list(self.threads)
+        return Trace(events, names, threads)
+
+    def dump(self, fname):
+        """Saves the recorded events to an npz file"""
+
+        trace = self.snapshot()
+        np.savez(fname, events=trace.events, names=np.asarray(trace.names, dtype=str),
+                 threads=np.asarray(trace.threads, dtype=str))
+        log.info('saved %d trace events to %s', len(trace.events), fname)
+
+
+class Trace():
+    """Recorded or replayed events with their PV name and thread tables"""
+
+    def __init__(self, events, names, threads):
+
+        self.events = events
+        self.names = list(names)
+        self.threads = list(threads)
+
+    def __len__(self):
+        return len(self.events)
+
+    def label(self, index):
+        event = self.events[index]
+        return '%s %s' % (OPS[event['op']], self.names[event['name']])
+
+
+def env_size(default=DEFAULT_SIZE):
+    """Returns the buffer size set in SCANLIB_TRACE_SIZE, default if unset or not a positive integer"""
+
+    value = os.environ.get('SCANLIB_TRACE_SIZE', '')
+    try:
+        size = int(value)
+    except ValueError:
+        if value:
+            log.warning('SCANLIB_TRACE_SIZE=%s is not an integer, using %d events', value, default)
+        return default
+    return size if size > 0 else default
+
+
+recorder = TraceRecorder(env_size())
+recorder.enabled = bool(os.environ.get('SCANLIB_TRACE'))
+
+
+def enable(size=None):
+    """Starts recording, optionally with a new buffer of size events"""
+
+    if size is not None:
+        recorder.resize(size)
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
+
+
+def dump(fname):
+    recorder.dump(fname)
+
+
+@contextlib.contextmanager
+def span(label):
+    """Records the time spent in a block of code as a span event"""
+
+    if not recorder.enabled:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        recorder.record('span', label, np.nan, start, time.time())
+
+
+def load(fname):
+    """Reads a trace saved by dump()"""
+
+    with np.load(fname) as npz:
+        return Trace(npz['events'], npz['names'].tolist(), npz['threads'].tolist())
+
+
+class SimBackend():
+    """Simulated IOC backend used to replay a trace.
+
+    Each (op, PV) pair answers after the median latency recorded for it in
+    the trace, times scale. Latencies can be overridden per PV name, e.g. to
+    see the effect of a faster motor.
+
+        Parameters
+        ----------
+        trace : Trace
+            Trace used to build the latency model
+        scale : float
+            Factor applied to every recorded latency
+        overrides : dict
+            PV name -> latency in seconds
+    """
+
+    def __init__(self, trace, scale=1.0, overrides=None):
+
+        self.scale = scale
+        self.overrides = overrides if overrides is not None else {}
+        self.values = {}
+        self.latencies = {}
+        events = trace.events
+        durations = events['end'] - events['start']
+        keys = events['op'].astype('u8') << 32 | events['name']
+        for key in np.unique(keys):
+            self.latencies[int(key)] = float(np.median(durations[keys == key]))
+        self.names = trace.names
+
+    def latency(self, op, name):
+        if self.names[name] in self.overrides:
+            return self.overrides[self.names[name]]
+        return self.scale * self.latencies.get(op << 32 | name, 0.0)
+
+    def execute(self, op, name, value):
+        """Executes one operation, returns its simulated duration"""
+
+        if OPS[op] in ('put', 'put_wait'):
+            self.values[name] = value
+        return self.latency(op, name)
+
+
+def replay(trace, backend=None):
+    """Replays the PV operations of a trace against a simulated backend.
+
+    Each thread keeps its recorded start time and the gaps between its
+    operations, while each operation takes the time given by the backend.
+
+    Returns
+    -------
+    Trace
+        The replayed events, on the simulated time line.
+    """
+
+    if backend is None:
+        backend = SimBackend(trace)
+    events = trace.events[trace.events['op'] != OPS.index('span')]
+    events = events[np.argsort(events['start'], kind='stable')]
+    replayed = events.copy()
+    for thread in np.unique(events['thread']):
+        indices = np.flatnonzero(events['thread'] == thread)
+        clock = events['start'][indices[0]]
+        previous_end = clock
+        for index in indices:
+            event = events[index]
+            clock += max(event['start'] - previous_end, 0.0)
+            previous_end = event['end']
+            replayed['start'][index] = clock
+            clock += backend.execute(int(event['op']), int(event['name']), event['value'])
+            replayed['end'][index] = clock
+    return Trace(replayed, trace.names, trace.threads)
+
+
+def critical_path(trace):
+    """Returns the indices of the events on the critical path, in time order.
+
+    Starting from the event that ends last, each step goes back to the
+    event that ended most recently before the current one started,
+    preferring the same thread on ties.
+    """
+
+    events = trace.events[trace.events['op'] != OPS.index('span')]
+    if len(events) == 0:
+        return []
+    pv_indices = np.flatnonzero(trace.events['op'] != OPS.index('span'))
+    order = np.lexsort((events['thread'], events['end']))
+    ends = events['end'][order]
+    path = [order[-1]]
+    while True:
+        current = events[path[-1]]
+        position = np.searchsorted(ends, current['start'], side='left') - 1
+        if position < 0:
+            break
+        candidates = order[:position + 1][ends[:position + 1] == ends[position]]
+        same_thread = candidates[events['thread'][candidates] == current['thread']]
+        path.append(same_thread[-1] if len(same_thread) else candidates[-1])
+    return [int(pv_indices[index]) for index in reversed(path)]
+
+
+def report(trace):
+    """Summarises the latencies of a trace.
+
+    Returns
+    -------
+    dict
+        wall time, busy and idle time on the critical path, per operation
+        statistics and the operations that take most of the critical path.
+    """
+
+    events = trace.events
+    if len(events) == 0:
+        return {'wall': 0.0, 'events': 0, 'operations': [], 'critical_path': [],
+                'critical_busy': 0.0, 'critical_idle': 0.0}
+    durations = events['end'] - events['start']
+    operations = []
+    keys = events['op'].astype('u8') << 32 | events['name']
+    for key in np.unique(keys):
+        selected = durations[keys == key]
+        index = int(np.flatnonzero(keys == key)[0])
+        operations.append({'operation': trace.label(index), 'count': len(selected),
+                           'total': float(selected.sum()), 'mean': float(selected.mean()),
+                           'max': float(selected.max())})
+    operations.sort(key=lambda operation: operation['total'], reverse=True)
+
+    path = critical_path(trace)
+    on_path = {}
+    busy = 0.0
+    for index in path:
+        label = trace.label(index)
+        on_path[label] = on_path.get(label, 0.0) + float(durations[index])
+        busy += float(durations[index])
+    wall = float(events['end'].max() - events['start'].min())
+    if path:
+        path_time = float(events['end'][path[-1]] - events['start'][path[0]])
+    else:
+        path_time = 0.0
+    return {'wall': wall, 'events': len(events), 'operations': operations,
+            'critical_path': sorted(on_path.items(), key=lambda item: item[1], reverse=True),
+            'critical_busy': busy, 'critical_idle': path_time - busy}
+
+
+def format_report(summary, top=10):
+    """Returns a report() summary as printable text"""
+
+    lines = ['wall time: %.3f s, %d events' % (summary['wall'], summary['events']),
+             'critical path: %.3f s in PV operations, %.3f s between them'
+             % (summary['critical_busy'], summary['critical_idle'])]
+    for label, total in summary['critical_path'][:top]:
+        lines.append('    %10.3f s  %s' % (total, label))
+    lines.append('operations (count, total, mean, max):')
+    for operation in summary['operations'][:top]:
+        lines.append('    %6d %10.3f s %10.4f s %10.4f s  %s' % (
+            operation['count'], operation['total'], operation['mean'],
+            operation['max'], operation['operation']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse a scanlib PV trace')
+    parser.add_argument('fname', help='trace file saved by scanlib.trace.dump()')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='factor applied to the recorded latencies during replay')
+    parser.add_argument('--top', type=int, default=10, help='number of operations listed')
+    args = parser.parse_args()
+
+    trace = load(args.fname)
+    print('recorded')
+    print(format_report(report(trace), args.top))
+    print('')
+    print('replayed (scale %.2f)' % args.scale)
+    print(format_report(report(replay(trace, SimBackend(trace, args.scale))), args.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+import sys
 import time
+import threading
+import importlib
 
 def tic():
     #Homemade version of matlab tic and toc functions
@@ -9,10 +12,44 @@ def toc():
     if 'startTime_for_tictoc' in globals():
        return time.time() - startTime_for_tictoc
 
+class LazyModule():
+    """Stand-in for a module, imported under a lock when one of its attributes is first used.
+
+    importlib.util.LazyLoader is not thread-safe: threads using the module
+    for the first time together can see it half initialised.
+    """
+
+    def __init__(self, name):
+
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<lazy module %s>' % self._name
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    """Returns module name, loaded only when one of its attributes is first used"""
+
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
 type_dict = {
 'uint8': 'ubyteValue',
 'float32': 'floatValue',
-'uint16' : 'ushortValue'
+'uint16' : 'ushortValue',
+'float64': 'doubleValue'
 # add others
 }
 
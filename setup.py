@@ -9,4 +9,7 @@ setup(
     include_package_data = True,
     description='Module to support scans',
     zip_safe=False,
+    entry_points={
+        'console_scripts': ['scanlib=scanlib.cli:main'],
+    },
 )
\ No newline at end of file
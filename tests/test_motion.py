@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from scanlib import motion
+from scanlib import simpv
+
+
+def move_time(distance, overhead=0.5, velocity=2.0, acceleration=8.0):
+    return overhead + distance / velocity + 2 * np.sqrt(distance / acceleration)
+
+
+def test_axis_model_fits_the_move_time():
+    axis_model = motion.AxisModel()
+    for distance in (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0):
+        axis_model.add(distance, move_time(distance), 0.1)
+
+    parameters = axis_model.parameters()
+
+    assert parameters['overhead'] == pytest.approx(0.5, rel=1e-3)
+    assert parameters['velocity'] == pytest.approx(2.0, rel=1e-3)
+    assert parameters['acceleration'] == pytest.approx(8.0, rel=1e-3)
+    assert axis_model.predict(3.0) == pytest.approx(move_time(3.0) + 0.1, rel=1e-3)
+
+
+def test_axis_model_predicts_after_min_samples():
+    axis_model = motion.AxisModel()
+    for _ in range(motion.MIN_SAMPLES - 1):
+        axis_model.add(1.0, 1.0, 0.0)
+    assert axis_model.predict(1.0) is None
+
+    axis_model.add(1.0, 1.0, 0.0)
+
+    assert axis_model.predict(1.0) == pytest.approx(1.0, rel=1e-3)
+    assert motion.AxisModel(axis_model.stats()).predict(1.0) == pytest.approx(1.0, rel=1e-3)
+
+
+def test_timeout_scales_with_the_predicted_time():
+    motion_model = motion.MotionModel(None)
+    assert motion_model.timeout('X', 5.0) == motion.DEFAULT_TIMEOUT
+
+    for distance in (1.0, 2.0, 5.0, 10.0, 20.0):
+        motion_model.record('X', distance, move_time(distance))
+
+    predicted = move_time(20.0)
+    assert motion_model.timeout('X', 20.0) == pytest.approx(
+        motion.TIMEOUT_FACTOR * predicted + motion.TIMEOUT_MARGIN, rel=1e-3)
+    assert motion_model.timeout('X', 0.0) == motion.MIN_TIMEOUT
+    # Each direction has a model of its own
+    assert motion_model.timeout('X', -5.0) == motion.DEFAULT_TIMEOUT
+
+
+def test_move_axes_times_motors_only(monkeypatch):
+    monkeypatch.setattr(motion, 'model', motion.MotionModel(None))
+    motor, parameter = simpv.SimPV('test:Motor'), simpv.SimPV('test:SampleInX')
+
+    moved = motion.move_axes([(motor, 1.0, simpv.SimPV('test:Motor.RBV')), (parameter, 2.0, None)])
+
+    assert moved.ok
+    assert sorted(moved.moved) == ['test:Motor', 'test:SampleInX']
+    assert list(motion.model.axes) == ['test:Motor:+']
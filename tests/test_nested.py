@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from scanlib import nested
+
+
+def test_nesting_order_puts_slow_axes_outside():
+    fast = nested.Axis('X', range(10), cost=1.0)
+    slow = nested.Axis('Energy', range(3), cost=30.0)
+    single = nested.Axis('Fixed', [0], cost=100.0)
+
+    axes = nested.nesting_order([fast, single, slow])
+
+    assert [axis.name for axis in axes][1:] == ['Energy', 'X']
+    assert nested.change_cost([slow, fast]) < nested.change_cost([fast, slow])
+
+
+def test_auto_order_has_lowest_change_cost():
+    axes = [nested.Axis('A', range(4), cost=2.0), nested.Axis('B', range(2), cost=3.0),
+            nested.Axis('C', range(5), cost=1.5)]
+    orders = [[axes[i], axes[j], axes[k]] for i in range(3) for j in range(3) for k in range(3)
+              if len({i, j, k}) == 3]
+
+    scan = nested.NestedScan(axes)
+
+    assert scan.cost() == pytest.approx(min(nested.change_cost(order) for order in orders))
+
+
+def test_steps_vary_innermost_axis_fastest():
+    scan = nested.NestedScan([nested.Axis('Y', [0, 1]), nested.Axis('X', [10, 20, 30])], order=['Y', 'X'])
+
+    steps = list(scan)
+
+    assert len(scan) == len(steps) == 6
+    assert [(step['positions']['Y'], step['positions']['X']) for step in steps] == [
+        (0, 10), (0, 20), (0, 30), (1, 10), (1, 20), (1, 30)]
+    assert steps[0]['changed'] == ['Y', 'X']
+    assert steps[1]['changed'] == ['X']
+    assert steps[3]['changed'] == ['Y', 'X']
+
+
+def test_order_must_name_every_axis():
+    with pytest.raises(ValueError):
+        nested.NestedScan([nested.Axis('Y', [0]), nested.Axis('X', [0])], order=['Y'])
+
+
+def test_empty_axis_gives_no_steps():
+    assert list(nested.NestedScan([nested.Axis('Y', []), nested.Axis('X', [0, 1])])) == []
+
+
+def test_run_sets_changed_axes_outer_first():
+    calls = []
+    axes = [nested.Axis('Y', [0, 1], lambda value: calls.append(('Y', value))),
+            nested.Axis('X', [10, 20], lambda value: calls.append(('X', value)))]
+
+    nested.NestedScan(axes, order=['Y', 'X']).run(lambda step: calls.append(('scan', step['index'])))
+
+    assert calls == [('Y', 0), ('X', 10), ('scan', 0), ('X', 20), ('scan', 1),
+                     ('Y', 1), ('X', 10), ('scan', 2), ('X', 20), ('scan', 3)]
+
+
+def test_run_stops_when_not_running_or_a_setter_fails():
+    scans = []
+    scan = nested.NestedScan([nested.Axis('X', range(5))])
+    scan.run(scans.append, is_running=lambda: len(scans) < 2)
+    assert len(scans) == 2
+
+    def setter(value):
+        if value == 1:
+            raise RuntimeError('stuck')
+    scans = []
+    with pytest.raises(RuntimeError):
+        nested.NestedScan([nested.Axis('X', range(5), setter)]).run(scans.append)
+    assert len(scans) == 1
+
+
+def test_repeat_axis_wait_ends_when_stopped():
+    axis = nested.repeat_axis(2, sleep_time=60)
+    axis.stop.set()
+    tic = time.monotonic()
+
+    axis.setter(1)
+
+    assert time.monotonic() - tic < 1
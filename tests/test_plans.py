@@ -0,0 +1,167 @@
+import threading
+
+import numpy as np
+import pytest
+
+from scanlib import nested
+from scanlib import plans
+from scanlib import scanfile
+
+TIMEOUT = 5
+
+
+class FakeStation():
+
+    def __init__(self, tomoscan_prefix):
+        self.tomoscan_prefix = tomoscan_prefix
+
+
+def plan(*prefixes, steps=1):
+    table = scanfile.ScanTable(np.array(['step_%d' % index for index in range(steps)]), {})
+    return plans.Plan('Single', table, [FakeStation(prefix) for prefix in prefixes])
+
+
+class Runner():
+    """Plan runner recording the plans started, each finishing when released"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.release = {}
+        self.changed = threading.Condition(self.lock)
+
+    def __call__(self, run_plan, future):
+        with self.lock:
+            self.started.append(run_plan)
+            self.release[id(run_plan)] = event = threading.Event()
+            self.changed.notify_all()
+        future.abort = event.set
+        event.wait(TIMEOUT)
+        if getattr(run_plan, 'error', None):
+            raise RuntimeError(run_plan.error)
+        return {'state': 'Done' if future.is_active() else 'Cancelled'}
+
+    def wait_started(self, count):
+        with self.lock:
+            assert self.changed.wait_for(lambda: len(self.started) >= count, TIMEOUT)
+            return list(self.started)
+
+    def finish(self, run_plan):
+        with self.lock:
+            assert self.changed.wait_for(lambda: run_plan in self.started, TIMEOUT)
+            release = self.release[id(run_plan)]
+        release.set()
+
+
+def test_plans_on_different_stations_run_together():
+    runner = Runner()
+    queue = plans.PlanQueue(runner)
+    first, second = plan('A:'), plan('B:')
+
+    futures = [queue.submit(first), queue.submit(second)]
+
+    assert runner.wait_started(2) == [first, second]
+    for run_plan in (first, second):
+        runner.finish(run_plan)
+    assert [future.result(TIMEOUT)['state'] for future in futures] == ['Done', 'Done']
+
+
+def test_plans_sharing_a_station_keep_their_order():
+    runner = Runner()
+    queue = plans.PlanQueue(runner)
+    first, both, second = plan('A:'), plan('A:', 'B:'), plan('B:')
+
+    futures = [queue.submit(first), queue.submit(both), queue.submit(second)]
+
+    # second is free to start but waits behind both, which needs B: too
+    assert runner.wait_started(1) == [first]
+    assert queue.status()['pending'] == [both, second]
+    runner.finish(first)
+    assert runner.wait_started(2) == [first, both]
+    runner.finish(both)
+    assert runner.wait_started(3) == [first, both, second]
+    runner.finish(second)
+    for future in futures:
+        assert future.result(TIMEOUT)['state'] == 'Done'
+
+
+def test_cancel_pending_and_running_plans():
+    runner = Runner()
+    queue = plans.PlanQueue(runner)
+    running, pending = plan('A:'), plan('A:')
+    running_future = queue.submit(running)
+    pending_future = queue.submit(pending)
+    runner.wait_started(1)
+
+    assert pending_future.cancel()
+    assert pending_future.cancelled()
+    assert running_future.cancel()
+    assert running_future.result(TIMEOUT)['state'] == 'Cancelled'
+    assert runner.started == [running]
+    assert [event['state'] for event in pending_future.events(TIMEOUT)] == ['Cancelled']
+
+
+def test_failed_plan_sets_the_exception_and_frees_its_station():
+    runner = Runner()
+    queue = plans.PlanQueue(runner)
+    failing, after = plan('A:'), plan('A:')
+    failing.error = 'tomoscan is down'
+    futures = [queue.submit(failing), queue.submit(after)]
+
+    runner.finish(failing)
+
+    with pytest.raises(RuntimeError):
+        futures[0].result(TIMEOUT)
+    assert [event['state'] for event in futures[0].events(TIMEOUT)] == ['Failed']
+    runner.finish(after)
+    assert futures[1].result(TIMEOUT)['state'] == 'Done'
+
+
+def test_events_replay_history_and_end_on_final_state():
+    future = plans.ScanFuture(plan('A:', steps=2))
+    seen = []
+    future.publish('Running')
+    future.add_listener(seen.append)
+    future.publish('Done', key='step_0', index=0)
+    future.publish('Done')
+
+    states = [(event['state'], event['key']) for event in future.events(TIMEOUT)]
+
+    assert states == [('Running', None), ('Done', 'step_0'), ('Done', None)]
+    assert [event['state'] for event in seen] == ['Running', 'Done', 'Done']
+    assert seen[-1]['total'] == 2
+
+
+def test_plan_checks_its_arguments():
+    with pytest.raises(ValueError):
+        plans.Plan('Spiral', scanfile.ScanTable(np.array([]), {}), [FakeStation('A:')])
+    with pytest.raises(ValueError):
+        plans.Plan('Single', scanfile.ScanTable(np.array([]), {}), [])
+    with pytest.raises(ValueError):
+        plans.Plan('Nested', scanfile.ScanTable(np.array([]), {}), [FakeStation('A:')])
+
+
+def test_nested_plan_steps_are_not_materialised():
+    scan = nested.NestedScan([nested.Axis('A', range(200)), nested.Axis('B', range(200)),
+                              nested.Axis('C', range(100))])
+
+    nested_plan = plans.Plan('Nested', None, [FakeStation('A:')], repeats=2, nested=scan)
+
+    assert nested_plan.steps == 4000000
+    assert len(nested_plan) == 8000000
+
+
+def test_cancelling_a_pending_plan_starts_the_plans_behind_it():
+    runner = Runner()
+    queue = plans.PlanQueue(runner)
+    first, both, second = plan('A:'), plan('A:', 'B:'), plan('B:')
+    futures = [queue.submit(first), queue.submit(both), queue.submit(second)]
+    runner.wait_started(1)
+
+    assert futures[1].cancel()
+
+    assert queue.status() == {'pending': [], 'running': [first, second]}
+    assert runner.wait_started(2) == [first, second]
+    for run_plan in (first, second):
+        runner.finish(run_plan)
+    assert futures[2].result(TIMEOUT)['state'] == 'Done'
@@ -0,0 +1,41 @@
+import numpy as np
+
+from scanlib import preflight
+from scanlib import scanfile
+
+
+def plan(**columns):
+    steps = len(next(iter(columns.values())))
+    return scanfile.ScanTable(np.array(['step_%d' % index for index in range(steps)]),
+                              {name: np.asarray(values) for name, values in columns.items()})
+
+
+def test_plan_within_limits_and_choices_passes():
+    table = plan(SampleX=[0.0, 1.0], SampleInY=[-1.0, 1.0], FlatFieldMode=['None', 'Start'])
+
+    errors = preflight.check(table, {'TSSampleX': (-1.0, 1.0), 'TSSampleY': (-2.0, 2.0)},
+                             {'FlatFieldMode': ['None', 'Start', 'End']})
+
+    assert errors == []
+
+
+def test_every_violation_is_reported_with_its_step():
+    table = plan(SampleX=[0.0, 5.0, -5.0], SampleOutY=[0.0, 0.0, 9.0], FlatFieldMode=['None', 'Both', 'None'])
+
+    errors = preflight.check(table, {'TSSampleX': (-1.0, 1.0), 'TSSampleY': (-2.0, 2.0)},
+                             {'FlatFieldMode': ['None', 'Start']})
+
+    assert len(errors) == 4
+    assert errors[0].startswith('step_1: SampleX = 5.000 outside motor limits')
+    assert errors[1].startswith('step_2: SampleX = -5.000')
+    assert errors[2].startswith('step_2: SampleOutY = 9.000')
+    assert errors[3].startswith('step_1: FlatFieldMode = Both not in')
+
+
+def test_unreadable_limits_of_a_moved_motor_are_a_violation():
+    table = plan(SampleY=[0.0])
+
+    assert preflight.check(table, {'TSSampleX': None, 'TSSampleY': None}, {}) == [
+        'SampleY: limits of TSSampleY could not be read']
+    # Motors without limits in the dictionary are not checked
+    assert preflight.check(table, {}, {}) == []
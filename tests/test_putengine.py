@@ -0,0 +1,69 @@
+from scanlib import putengine
+
+
+class FakePV():
+    """PV whose puts return the given statuses in turn, then complete"""
+
+    def __init__(self, pvname, statuses=(), readback=None):
+        self.pvname = pvname
+        self.statuses = list(statuses)
+        self.readback = readback
+        self.value = None
+        self.puts = 0
+
+    def put(self, value, wait=False, timeout=None):
+        self.puts += 1
+        status = self.statuses.pop(0) if self.statuses else 1
+        if isinstance(status, Exception):
+            raise status
+        if status == 1:
+            self.value = value
+        return status
+
+    def get(self, as_string=False, use_monitor=True):
+        value = self.value if self.readback is None else self.readback
+        return str(value) if as_string else value
+
+
+def test_failed_put_is_retried_with_backoff():
+    engine = putengine.PutEngine(retries=2, backoff=0.05)
+    epics_pv = FakePV('T:ExposureTime', statuses=[-1, None])
+
+    result = engine.put_one(epics_pv, 0.1, confirm=False)
+
+    assert result.ok and result.error is None
+    assert result.attempts == epics_pv.puts == 3
+    # The delay doubles at each retry
+    assert result.elapsed >= 0.05 + 0.1
+
+
+def test_put_fails_once_retries_are_exhausted():
+    engine = putengine.PutEngine(retries=1, backoff=0.01)
+    epics_pv = FakePV('T:ExposureTime', statuses=[RuntimeError('channel closed'), 0])
+
+    result = engine.put_one(epics_pv, 0.1, confirm=False)
+
+    assert not result.ok
+    assert result.attempts == 2
+    assert result.error == 'put failed (status 0)'
+
+
+def test_confirm_compares_the_readback():
+    engine = putengine.PutEngine(retries=1, backoff=0.01)
+
+    confirmed = engine.put_one(FakePV('T:FlatFieldMode'), 'Start', confirm=True)
+    stale = engine.put_one(FakePV('T:NumAngles', readback=1500), 1800, confirm=True)
+
+    assert confirmed.ok and confirmed.readback == 'Start'
+    assert not stale.ok and stale.error == 'readback 1500' and stale.attempts == 2
+    assert engine.put_one(FakePV('T:NumAngles', readback=1500), 1800, confirm=False).ok
+
+
+def test_batch_reports_every_put():
+    engine = putengine.PutEngine(retries=0)
+
+    batch = engine.put_batch([(FakePV('T:A'), 1.0), (FakePV('T:B', statuses=[-1]), 2.0)])
+
+    assert not batch
+    assert [result.pvname for result in batch.failed] == ['T:B']
+    assert batch.summary().startswith('1/2 puts ok')
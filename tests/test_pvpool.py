@@ -0,0 +1,40 @@
+import time
+
+from scanlib import pvpool
+
+
+def test_get_pv_shares_one_channel_per_name():
+    pool = pvpool.PVPool('sim')
+
+    first = pool.get_pv('T:SampleX')
+
+    assert pool.get_pv('T:SampleX') is first
+    assert pool.stats()['channels'] == pool.stats()['created'] == 1
+
+
+def test_evict_idle_disconnects_unused_channels():
+    pool = pvpool.PVPool('sim')
+    idle, used = pool.get_pv('T:Idle'), pool.get_pv('T:Used')
+    idle.last_used = used.last_used = time.time() - 10
+    used.get()
+
+    pool.evict_idle(max_idle=5)
+
+    assert list(pool.pvs) == ['T:Used']
+    assert not idle.connected
+    assert pool.stats()['evicted'] == 1
+    # An evicted channel is created again on next use
+    assert pool.get_pv('T:Idle') is not idle
+
+
+def test_pinned_channels_are_never_evicted():
+    pool = pvpool.PVPool('sim')
+    pool.get_pv('T:Pinned', pin=True).last_used = time.time() - 10
+    # Pinning an existing channel keeps it too
+    pool.get_pv('T:Later')
+    pool.get_pv('T:Later', pin=True).last_used = time.time() - 10
+
+    pool.evict_idle(max_idle=5)
+
+    assert sorted(pool.pvs) == ['T:Later', 'T:Pinned']
+    assert pool.stats()['pinned'] == 2
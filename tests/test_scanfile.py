@@ -0,0 +1,102 @@
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+from scanlib import scanfile
+
+
+def scan_dict(entries=3):
+    base = {name: 0.0 for name in scanfile.SCAN_PARAMS}
+    base.update({name: 'No' for name in scanfile.STRING_PARAMS})
+    base.update(NumAngles=1500, ExposureTime=0.1, FlatExposureTime=0.1, FlatFieldMode='None')
+    return {'entry_%d' % index: dict(base, SampleX=float(index), SampleY=0.5 * index)
+            for index in range(entries)}
+
+
+def write_npz(fname, arrays, force_zip64=False, extra=b''):
+    """Writes arrays as stored npy members, with a zip64 or extra field in each local header"""
+
+    with zipfile.ZipFile(fname, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        for name, array in arrays.items():
+            info = zipfile.ZipInfo(name + '.npy')
+            info.extra = extra
+            with zip_file.open(info, 'w', force_zip64=force_zip64) as member:
+                np.lib.format.write_array(member, np.asarray(array))
+
+
+def test_from_dict_stores_shared_values_once():
+    table = scanfile.ScanTable.from_dict(scan_dict())
+
+    assert len(table) == 3
+    assert set(table.columns) == {'SampleX', 'SampleY'}
+    assert table.defaults['NumAngles'] == 1500
+    assert list(table['NumAngles']) == [1500] * 3
+    assert table.validate() == []
+
+
+def test_validate_reports_missing_and_out_of_range():
+    entries = scan_dict(2)
+    del entries['entry_0']['ExposureTime']
+    del entries['entry_1']['ExposureTime']
+    entries['entry_1']['NumAngles'] = 0
+    errors = scanfile.ScanTable.from_dict(entries).validate()
+
+    assert any('missing parameters: ExposureTime' in error for error in errors)
+    assert any('entry_1: NumAngles' in error for error in errors)
+
+
+def test_convert_round_trip(tmp_path):
+    src = tmp_path / 'scan.json'
+    src.write_text(json.dumps(scan_dict()))
+    npz = tmp_path / 'scan.npz'
+    back = tmp_path / 'back.json'
+
+    scanfile.convert(str(src), str(npz))
+    scanfile.convert(str(npz), str(back))
+
+    assert json.loads(back.read_text()) == scan_dict()
+    table = scanfile.load(str(npz))
+    assert isinstance(table.columns['SampleX'], np.memmap)
+    assert list(table.keys) == ['entry_0', 'entry_1', 'entry_2']
+    assert table.entry(2)['SampleX'] == 2.0
+    assert table.entry(2)['FlatFieldMode'] == 'None'
+
+
+@pytest.mark.parametrize('force_zip64, extra', [
+    (False, b''),
+    (True, b''),
+    (False, b'\xfe\xca\x04\x00abcd'),
+    (True, b'\xfe\xca\x08\x00abcdefgh'),
+])
+def test_load_npz_finds_data_after_local_header(tmp_path, force_zip64, extra):
+    fname = str(tmp_path / 'scan.npz')
+    arrays = {scanfile.KEYS_NAME: np.array(['a', 'b', 'c']),
+              'SampleX': np.array([1.0, 2.0, 3.0]),
+              'NumAngles': np.array(1500)}
+    write_npz(fname, arrays, force_zip64, extra)
+
+    loaded = scanfile._load_npz(fname)
+
+    assert isinstance(loaded['SampleX'], np.memmap)
+    assert list(loaded['SampleX']) == [1.0, 2.0, 3.0]
+    assert list(loaded[scanfile.KEYS_NAME]) == ['a', 'b', 'c']
+    assert loaded['NumAngles'] == 1500
+
+
+def test_load_npz_reads_compressed_members(tmp_path):
+    fname = str(tmp_path / 'scan.npz')
+    np.savez_compressed(fname, **{scanfile.KEYS_NAME: np.array(['a', 'b']), 'SampleX': np.array([1.0, 2.0])})
+
+    table = scanfile.load(fname)
+
+    assert list(table['SampleX']) == [1.0, 2.0]
+
+
+def test_load_npz_rejects_columns_of_different_lengths(tmp_path):
+    fname = str(tmp_path / 'scan.npz')
+    np.savez(fname, **{scanfile.KEYS_NAME: np.array(['a', 'b']), 'SampleX': np.array([1.0, 2.0, 3.0])})
+
+    with pytest.raises(ValueError):
+        scanfile.load(fname)
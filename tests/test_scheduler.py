@@ -0,0 +1,54 @@
+import time
+import threading
+
+from scanlib import scheduler
+
+TIMEOUT = 5
+
+
+def test_every_returns_the_task_already_scheduled_under_a_name():
+    tasks = scheduler.Scheduler()
+    first = tasks.every(60, lambda: None, name='watchdog')
+
+    assert tasks.every(60, lambda: None, name='watchdog') is first
+    assert tasks.stats()['tasks'] == 1
+
+
+def test_cancelled_task_stops_and_its_name_can_be_reused():
+    tasks = scheduler.Scheduler()
+    ran = threading.Event()
+    task = tasks.every(0.01, ran.set, name='poll')
+    assert ran.wait(TIMEOUT)
+
+    task.cancel()
+
+    assert tasks.stats()['tasks'] == 0
+    assert tasks.every(60, lambda: None, name='poll') is not task
+    # A run already started when the task was cancelled may still end
+    time.sleep(0.05)
+    runs = task.runs
+    time.sleep(0.1)
+    assert task.runs == runs
+
+
+def test_failing_task_keeps_running():
+    tasks = scheduler.Scheduler()
+    calls = threading.Semaphore(0)
+
+    def fail():
+        calls.release()
+        raise RuntimeError('PV not connected')
+    task = tasks.every(0.01, fail)
+
+    assert calls.acquire(timeout=TIMEOUT) and calls.acquire(timeout=TIMEOUT)
+    task.cancel()
+    assert task.errors >= 1
+
+
+def test_submit_runs_on_the_shared_workers():
+    tasks = scheduler.Scheduler(max_workers=2)
+
+    futures = [tasks.submit(pow, 2, index) for index in range(5)]
+
+    assert [future.result(TIMEOUT) for future in futures] == [1, 2, 4, 8, 16]
+    assert tasks.stats()['workers'] <= 2
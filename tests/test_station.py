@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import pytest
+
+from scanlib import motion
+from scanlib import pvpool
+from scanlib import scanfile
+from scanlib import station
+
+
+@pytest.fixture
+def sim_station(monkeypatch):
+    """Station whose PVs are simulated, the sample stage motors being sim:SampleX and sim:SampleY"""
+
+    monkeypatch.setattr(pvpool, 'pool', pvpool.PVPool('sim'))
+    monkeypatch.setattr(motion, 'model', motion.MotionModel(None))
+    epics_pvs = {'TS' + name: pvpool.get_pv('T:' + name) for name in scanfile.SCAN_PARAMS}
+    epics_pvs.update(TSSampleX=pvpool.get_pv('sim:SampleX'), TSSampleY=pvpool.get_pv('sim:SampleY'))
+    return station.Station('T:', epics_pvs)
+
+
+class FakeStation():
+    """Idle tomoscan station recording the entries it is given"""
+
+    def __init__(self, tomoscan_prefix, fail=()):
+        self.tomoscan_prefix = tomoscan_prefix
+        self.fail = fail
+        self.current = None
+        self.entries_done = 0
+        self.entries = []
+
+    def is_running(self):
+        return True
+
+    def is_ready(self):
+        return True
+
+    def set_entry(self, key, value):
+        self.entries.append(key)
+        if key in self.fail:
+            raise RuntimeError('cannot set %s' % key)
+
+    def start_scan(self):
+        pass
+
+
+def table(entries):
+    return scanfile.ScanTable(np.array(['entry_%d' % index for index in range(entries)]),
+                              {'SampleX': np.arange(entries, dtype=float)})
+
+
+def test_readback_only_for_motors(sim_station):
+    assert sim_station.readback('TSSampleX').pvname == 'sim:SampleX.RBV'
+    assert sim_station.readback('TSSampleInX') is None
+    assert sim_station.readback('TSSampleInY') is None
+
+
+def test_move_axes_moves_motors_and_parameters(sim_station):
+    moved = sim_station.move_axes({'TSSampleX': 1.0, 'TSSampleInX': 2.0})
+
+    assert moved.ok
+    assert sorted(moved.moved) == ['T:SampleInX', 'sim:SampleX']
+    # The parameter is not compared to the motor readback, so nothing waits for it to settle
+    assert moved.wall_time < motion.SETTLE_TIMEOUT
+    assert sim_station.epics_pvs['TSSampleInX'].get() == 2.0
+    assert sim_station.readback('TSSampleX').get() == 1.0
+
+
+def test_move_axes_skips_axes_at_target(sim_station):
+    sim_station.epics_pvs['TSSampleInY'].put(3.0)
+
+    moved = sim_station.move_axes({'TSSampleY': 0.0, 'TSSampleInY': 3.0})
+
+    assert moved.ok
+    assert sorted(moved.skipped) == ['T:SampleInY', 'sim:SampleY']
+
+
+def test_set_entry_moves_the_axes_of_the_entry_flat_fields(sim_station):
+    sim_station.epics_pvs['TSFlatFieldMode'].put('None')
+    entry = {name: 0.0 for name in scanfile.SCAN_PARAMS}
+    entry.update(SampleX=1.0, SampleY=2.0, FlatFieldAxis='Y', FlatFieldMode='Start')
+
+    sim_station.set_entry('entry_0', entry)
+
+    # The flat fields move the sample out in Y, so the Y in position follows the sample
+    assert sim_station.epics_pvs['TSSampleInY'].get() == 2.0
+    assert sim_station.epics_pvs['TSSampleInX'].get() == 0.0
+    assert sim_station.readback('TSSampleY').get() == 2.0
+
+
+def test_dispatcher_shares_the_entries_between_stations():
+    stations = [FakeStation('A:', fail=('entry_3',)), FakeStation('B:', fail=('entry_3',))]
+    dispatcher = station.Dispatcher(stations, poll_time=0.01)
+
+    not_done = dispatcher.run(table(6))
+
+    assert sorted(stations[0].entries + stations[1].entries) == ['entry_%d' % index for index in range(6)]
+    assert not_done == dispatcher.failed == ['entry_3']
+    assert dispatcher.done == 6
+
+
+def test_dispatcher_returns_the_entries_not_taken_when_stopped():
+    stations = [FakeStation('A:')]
+    running = threading.Event()
+    running.set()
+    dispatcher = station.Dispatcher(stations, poll_time=0.01,
+                                    step_callback=lambda key, scan_station, state:
+                                    running.clear() if key == 'entry_1' else None)
+
+    not_done = dispatcher.run(table(5), running.is_set)
+
+    assert stations[0].entries == ['entry_0', 'entry_1']
+    assert not_done == ['entry_2', 'entry_3', 'entry_4']
@@ -0,0 +1,53 @@
+import numpy as np
+
+from scanlib import trace
+
+
+def recorded(events):
+    """Returns a Trace of (op, name, start, end, thread) events"""
+
+    recorder = trace.TraceRecorder(16)
+    for op, name, start, end, thread in events:
+        recorder.record(op, name, 0.0, start, end, thread=thread)
+    return recorder.snapshot()
+
+
+def test_critical_path_follows_the_latest_dependency():
+    events = recorded([
+        ('span', 'scan', 0.0, 10.0, 'A'),
+        ('get', 'x', 0.0, 1.0, 'A'),
+        ('put', 'y', 1.0, 3.0, 'A'),
+        ('get', 'z', 0.0, 2.5, 'B'),
+        ('put_wait', 'w', 2.6, 4.0, 'B'),
+    ])
+
+    path = trace.critical_path(events)
+
+    assert [events.label(index) for index in path] == ['get z', 'put_wait w']
+
+
+def test_critical_path_prefers_the_same_thread_on_ties():
+    events = recorded([
+        ('get', 'a', 0.0, 0.9, 'A'),
+        ('get', 'b', 0.0, 0.9, 'B'),
+        ('put', 'c', 1.0, 2.0, 'B'),
+    ])
+
+    path = trace.critical_path(events)
+
+    assert [events.label(index) for index in path] == ['get b', 'put c']
+
+
+def test_critical_path_of_spans_only_is_empty():
+    assert trace.critical_path(recorded([('span', 'scan', 0.0, 1.0, 'A')])) == []
+
+
+def test_ring_buffer_keeps_the_latest_events_in_order():
+    recorder = trace.TraceRecorder(4)
+    for index in range(6):
+        recorder.record('get', 'pv%d' % index, index, float(index), index + 0.5)
+
+    events = recorder.snapshot()
+
+    assert [events.names[name] for name in events.events['name']] == ['pv2', 'pv3', 'pv4', 'pv5']
+    assert np.all(np.diff(events.events['start']) > 0)